@@ -1,18 +1,105 @@
 import sqlite3
 import functools
-from datetime import datetime
+import inspect
+import time
+from query_log import call_params, caller, mark_internal, record_query
+
+mark_internal(__file__)
+
+def _count(result):
+    return len(result) if isinstance(result, list) else None
+
+# Decorator to log SQL queries as structured, sampled records
+def log_queries(func=None, *, sample_rate=None, slow_ms=None):
+    """Log each call's query fingerprint, duration, row count and caller.
+
+    Usable bare (@log_queries) or with options. Records go through a
+    background queue (see query_log), so the call itself only pays for
+    two clock reads, a metrics update and the sampling check. Slow and
+    failed queries are always logged; others with probability
+    `sample_rate`. Every call feeds query_metrics.registry. Coroutine
+    functions are timed from the first await to their result, (async)
+    generator functions from the first row requested until the stream
+    ends, with the number of rows it yielded.
+    """
+    if func is None:
+        return functools.partial(
+            log_queries, sample_rate=sample_rate, slow_ms=slow_ms
+        )
+    name = func.__qualname__
+    signature = inspect.signature(func)
+
+    def record(args, kwargs, started, frame, rows=None, error=None):
+        query = kwargs.get('query') or (args[0] if args else None)
+        if not isinstance(query, str):
+            query = None
+        record_query(query, time.perf_counter() - started, rows=rows,
+                     params=lambda: call_params(signature, args, kwargs),
+                     caller=frame, error=error,
+                     sample_rate=sample_rate, slow_ms=slow_ms, name=name)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                record(args, kwargs, started, caller(), error=e)
+                raise
+            record(args, kwargs, started, caller(), _count(result))
+            return result
+        return async_wrapper
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            frame = caller()
+            started = time.perf_counter()
+            rows = 0
+            error = None
+            try:
+                for row in func(*args, **kwargs):
+                    rows += 1
+                    yield row
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                # Also reached when the consumer closes the stream early
+                record(args, kwargs, started, frame, rows, error)
+        return gen_wrapper
+
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def agen_wrapper(*args, **kwargs):
+            frame = caller()
+            started = time.perf_counter()
+            rows = 0
+            error = None
+            stream = func(*args, **kwargs)
+            try:
+                async for row in stream:
+                    rows += 1
+                    yield row
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                await stream.aclose()
+                record(args, kwargs, started, frame, rows, error)
+        return agen_wrapper
 
-# Decorator to log SQL queries with date and time
-def log_queries(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        query = kwargs.get('query') or (args[0] if args else None)
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if query:
-            print(f"[{current_time}] Executing query: {query}")
-        else:
-            print(f"[{current_time}] No SQL query found to execute.")
-        return func(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            record(args, kwargs, started, caller(), error=e)
+            raise
+        record(args, kwargs, started, caller(), _count(result))
+        return result
     return wrapper
 
 @log_queries
@@ -25,4 +112,4 @@ def fetch_all_users(query):
     return results
 
 #### fetch users while logging the query
-users = fetch_all_users(query="SELECT * FROM users")
\ No newline at end of file
+users = fetch_all_users(query="SELECT * FROM users")
@@ -1,17 +1,15 @@
-import sqlite3
-import functools
-
-# Decorator to handle DB connection setup and teardown
-def with_db_connection(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            # Pass connection as the first argument to the wrapped function
-            return func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-    return wrapper
+import re
+
+# Connections come from a per-thread pool instead of sqlite3.connect()
+from db_pool import variable_limit, with_db_connection
+
+# Upper bound on ids per IN (...) even where SQLite allows more, since
+# each cached statement's size grows with its parameter count.
+MAX_IN_IDS = 512
+
+# Text that SQLite's INTEGER affinity turns into an integer.
+INTEGER_TEXT = re.compile(r"\s*[+-]?\d+\s*", re.ASCII)
+
 
 @with_db_connection
 def get_user_by_id(conn, user_id):
@@ -19,6 +17,57 @@ def get_user_by_id(conn, user_id):
     cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
     return cursor.fetchone()
 
+
+def _chunk_size(count, limit):
+    """Round `count` up to a power of two, at most `limit`.
+
+    Chunks are padded to that size so only a handful of distinct IN
+    lists are ever prepared and they stay in the statement cache.
+    """
+    size = 1
+    while size < count:
+        size *= 2
+    return min(size, limit)
+
+
+def _as_id(user_id):
+    """Convert `user_id` like the INTEGER id column does ("3" -> 3)."""
+    if isinstance(user_id, str) and INTEGER_TEXT.fullmatch(user_id):
+        return int(user_id)
+    return user_id
+
+
+@with_db_connection
+def get_users_by_ids(conn, ids):
+    """Fetch many users at once; returns rows in the order of `ids`.
+
+    Ids are looked up in IN (...) queries of at most MAX_IN_IDS ids, or
+    the connection's variable limit if that is lower. Missing ids give
+    None; repeated ids repeat their row. `ids` may be any iterable, and
+    integer strings match like they do in SQL.
+    """
+    ids = [_as_id(user_id) for user_id in ids]
+    wanted = list(dict.fromkeys(ids))
+    if not wanted:
+        return []
+    limit = min(variable_limit(conn), MAX_IN_IDS)
+    found = {}
+    cursor = conn.cursor()
+    for start in range(0, len(wanted), limit):
+        chunk = wanted[start:start + limit]
+        size = _chunk_size(len(chunk), limit)
+        chunk += [chunk[-1]] * (size - len(chunk))
+        cursor.execute(
+            f"SELECT * FROM users WHERE id IN ({','.join('?' * size)})", chunk
+        )
+        key = [column[0] for column in cursor.description].index("id")
+        for row in cursor:
+            found[row[key]] = row
+    return [found.get(user_id) for user_id in ids]
+
 # Fetch user by ID with automatic connection handling
 user = get_user_by_id(user_id=1)
-print(user)
\ No newline at end of file
+print(user)
+
+# Fetch several users in one query, in the order asked for
+print(get_users_by_ids(ids=[3, 1, 2]))
@@ -1,29 +1,124 @@
-import sqlite3
 import functools
+import inspect
+from db_pool import with_db_connection
+from group_commit import committer, in_batch, savepoint
+from query_cache import (
+    atracing, database_identity, invalidate_tables, tracing, written_tables
+)
+from query_log import mark_internal
 
-# Decorator to handle database connection
-def with_db_connection(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            return func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-    return wrapper
+mark_internal(__file__, inspect.getfile(with_db_connection),
+              inspect.getfile(savepoint))
+
+# Decorator to handle database transaction; once committed, cached
+# results read from the tables it wrote are invalidated
+def transactional(func=None, *, group_commit=False):
+    """Commit on success, roll back on error.
+
+    Inside a group_commit.batch() block the call runs in a savepoint of
+    the batch's transaction instead. With group_commit=True, calls from
+    all threads are handed to a GroupCommitter that commits everything
+    arriving within a short window at once; each caller still gets its
+    own result or exception.
+
+    Coroutine functions get the plain commit/rollback on their aiosqlite
+    connection; batches and group commit are thread-based and not
+    available to them. For (async) generator functions the transaction
+    spans the stream: it commits once the generator is exhausted and
+    rolls back if it fails or is closed early.
+    """
+    if func is None:
+        return functools.partial(transactional, group_commit=group_commit)
+
+    if inspect.iscoroutinefunction(func):
+        if group_commit:
+            raise TypeError("group_commit is not supported for coroutine functions")
+
+        @functools.wraps(func)
+        async def async_wrapper(conn, *args, **kwargs):
+            try:
+                async with atracing(conn) as statements:
+                    result = await func(conn, *args, **kwargs)
+                await conn.commit()
+            except Exception as e:
+                await conn.rollback()
+                print(f"Transaction failed: {e}")
+                raise
+            invalidate_tables(written_tables(statements))
+            return result
+        return async_wrapper
+
+    if inspect.isgeneratorfunction(func):
+        if group_commit:
+            raise TypeError("group_commit is not supported for generator functions")
+
+        @functools.wraps(func)
+        def gen_wrapper(conn, *args, **kwargs):
+            if in_batch(conn):
+                with savepoint(conn):
+                    yield from func(conn, *args, **kwargs)
+                return
+            try:
+                with tracing(conn) as statements:
+                    yield from func(conn, *args, **kwargs)
+                conn.commit()
+            except GeneratorExit:
+                conn.rollback()  # Closed before the end
+                raise
+            except Exception as e:
+                conn.rollback()
+                print(f"Transaction failed: {e}")
+                raise
+            invalidate_tables(written_tables(statements))
+        return gen_wrapper
+
+    if inspect.isasyncgenfunction(func):
+        if group_commit:
+            raise TypeError("group_commit is not supported for generator functions")
+
+        @functools.wraps(func)
+        async def agen_wrapper(conn, *args, **kwargs):
+            rows = func(conn, *args, **kwargs)
+            try:
+                async with atracing(conn) as statements:
+                    try:
+                        async for row in rows:
+                            yield row
+                    finally:
+                        await rows.aclose()
+                await conn.commit()
+            except GeneratorExit:
+                await conn.rollback()  # Closed before the end
+                raise
+            except Exception as e:
+                await conn.rollback()
+                print(f"Transaction failed: {e}")
+                raise
+            invalidate_tables(written_tables(statements))
+        return agen_wrapper
 
-# Decorator to handle database transaction
-def transactional(func):
     @functools.wraps(func)
     def wrapper(conn, *args, **kwargs):
+        if in_batch(conn) or group_commit:
+            try:
+                if in_batch(conn):
+                    with savepoint(conn):
+                        return func(conn, *args, **kwargs)
+                database = database_identity(conn)
+                return committer(database).submit(func, args, kwargs)
+            except Exception as e:
+                print(f"Transaction failed: {e}")
+                raise
         try:
-            result = func(conn, *args, **kwargs)
+            with tracing(conn) as statements:
+                result = func(conn, *args, **kwargs)
             conn.commit()
-            return result
         except Exception as e:
             conn.rollback()
             print(f"Transaction failed: {e}")
             raise
+        invalidate_tables(written_tables(statements))
+        return result
     return wrapper
 
 @with_db_connection
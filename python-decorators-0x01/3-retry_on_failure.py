@@ -1,35 +1,84 @@
-import time
-import sqlite3 
 import functools
+import inspect
+import retry_policy
+from db_pool import with_db_connection
+from query_log import mark_internal
 
-# Decorator to handle DB connection
-def with_db_connection(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            return func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-    return wrapper
+mark_internal(__file__, retry_policy.__file__,
+              inspect.getfile(with_db_connection))
 
 # Decorator to retry function on failure
-def retry_on_failure(retries=3, delay=2):
+def retry_on_failure(retries=3, delay=2, backoff="exponential", max_delay=30,
+                     retry_on=None, retry_budget=retry_policy.budget):
+    """Retry transient failures with backoff.
+
+    `backoff` is "constant", "exponential" (full jitter) or
+    "decorrelated", starting at `delay` seconds and capped at `max_delay`.
+    Only errors matched by `retry_on` (exception classes or a predicate;
+    by default SQLite lock/busy errors) are retried, and every retry
+    spends from the process-wide `retry_budget`. Attempts are counted in
+    retry_policy.stats. Coroutine functions are retried with asyncio.sleep().
+    Generator and async generator functions are retried until they
+    produce their first row; rows already handed to the caller cannot be
+    taken back, so later errors are raised as they are.
+    """
+    if backoff not in retry_policy.BACKOFFS:
+        raise ValueError(f"Unknown backoff strategy {backoff!r}")
+    retryable = retry_policy.classifier(retry_on)
+
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await retry_policy.call_async(
+                    lambda: func(*args, **kwargs), retries, delay, backoff,
+                    max_delay, retryable, retry_budget
+                )
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                def start():
+                    rows = func(*args, **kwargs)
+                    for first in rows:
+                        return rows, [first]
+                    return rows, []
+                rows, head = retry_policy.call(
+                    start, retries, delay, backoff, max_delay, retryable,
+                    retry_budget
+                )
+                yield from head
+                yield from rows
+            return gen_wrapper
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def agen_wrapper(*args, **kwargs):
+                async def start():
+                    rows = func(*args, **kwargs)
+                    async for first in rows:
+                        return rows, [first]
+                    return rows, []
+                rows, head = await retry_policy.call_async(
+                    start, retries, delay, backoff, max_delay, retryable,
+                    retry_budget
+                )
+                try:
+                    for row in head:
+                        yield row
+                    async for row in rows:
+                        yield row
+                finally:
+                    await rows.aclose()
+            return agen_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            attempt = 0
-            while attempt < retries:
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    attempt += 1
-                    print(f"Attempt {attempt} failed: {e}")
-                    if attempt < retries:
-                        time.sleep(delay)
-                    else:
-                        print("All retries failed.")
-                        raise
+            return retry_policy.call(
+                lambda: func(*args, **kwargs), retries, delay, backoff,
+                max_delay, retryable, retry_budget
+            )
         return wrapper
     return decorator
 
@@ -1,33 +1,200 @@
+import asyncio
 import time
-import sqlite3 
 import functools
+import inspect
+from db_pool import get_async_pool, get_pool, with_db_connection
+from query_cache import (
+    FRESH, STALE, SingleFlight, adatabase_identity, atracing,
+    database_identity, default_cache, key_builder,
+    refresh_executor,
+    tables_in, tracing
+)
+from query_log import mark_internal
 
-query_cache = {}
+mark_internal(__file__, inspect.getfile(with_db_connection))
 
-# Decorator to handle database connection
-def with_db_connection(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
+query_cache = default_cache
+
+# Decorator to cache query results
+def cache_query(func=None, *, ttl=None, stale_ttl=0, refresh_interval=1.0,
+                cache=None, max_rows=10000):
+    """Cache results in a bounded LRU/TTL QueryCache.
+
+    Usable bare (@cache_query) or with options (@cache_query(ttl=60)).
+    Keys cover the database, the normalized SQL and all bound arguments.
+    Entries are tagged with the tables their query read, so transactional
+    writes to those tables invalidate them. Concurrent misses on the same
+    key run the query once and share the result.
+
+    With `stale_ttl`, an expired entry is still returned for that many
+    seconds while a background worker re-runs the query on a pooled
+    connection, at most once per `refresh_interval` seconds per key.
+
+    Coroutine functions are cached the same way; their refreshes run as
+    tasks on the event loop, and coroutines and threads asking for the
+    same key share one query.
+
+    Generator and async generator functions stream on a miss: rows are
+    passed on as they come and cached only if the stream is read to the
+    end and has at most `max_rows` rows. Hits replay the cached rows;
+    stale entries are streamed afresh.
+    """
+    if func is None:
+        return functools.partial(
+            cache_query, ttl=ttl, stale_ttl=stale_ttl,
+            refresh_interval=refresh_interval, cache=cache, max_rows=max_rows
+        )
+    store = query_cache if cache is None else cache
+    make_key = key_builder(func)
+    flights = SingleFlight()
+
+    def fill(conn, key, args, kwargs):
+        since = store.generation()
+        with tracing(conn) as statements:
+            result = func(conn, *args, **kwargs)
+        tables = set().union(*map(tables_in, statements))
+        store.set(key, result, tables=tables, ttl=ttl, stale_ttl=stale_ttl,
+                  since=since)
+        return result
+
+    def refresh(key, args, kwargs):
         try:
-            return func(conn, *args, **kwargs)
-        finally:
-            conn.close()
+            # key[0] is the database file
+            with get_pool(key[0]).connection() as conn:
+                flights.do(key, lambda: fill(conn, key, args, kwargs))
+        except Exception as e:
+            print(f"Background refresh failed: {e}")
+
+    if inspect.iscoroutinefunction(func):
+        return _async_cache_query(
+            func, store, make_key, flights, ttl, stale_ttl, refresh_interval
+        )
+    if inspect.isgeneratorfunction(func):
+        return _stream_cache_query(
+            func, store, make_key, ttl, stale_ttl, max_rows
+        )
+    if inspect.isasyncgenfunction(func):
+        return _async_stream_cache_query(
+            func, store, make_key, ttl, stale_ttl, max_rows
+        )
+
+    @functools.wraps(func)
+    def wrapper(conn, *args, **kwargs):
+        key = make_key(database_identity(conn), conn, *args, **kwargs)
+        state, result = store.lookup(key)
+        if state == FRESH:
+            print("Returning cached result.")
+            return result
+        if state == STALE:
+            if store.claim_refresh(key, refresh_interval):
+                refresh_executor().submit(refresh, key, args, kwargs)
+            print("Returning stale result while it is refreshed.")
+            return result
+        result = flights.do(key, lambda: fill(conn, key, args, kwargs))
+        print("Query executed and result cached.")
+        return result
     return wrapper
 
-# Decorator to cache query results
-def cache_query(func):
+
+def _stream_cache_query(func, store, make_key, ttl, stale_ttl, max_rows):
     @functools.wraps(func)
     def wrapper(conn, *args, **kwargs):
-        query = kwargs.get("query")
-        if query in query_cache:
+        key = make_key(database_identity(conn), conn, *args, **kwargs)
+        state, rows = store.lookup(key)
+        if state == FRESH:
             print("Returning cached result.")
-            return query_cache[query]
-        else:
-            result = func(conn, *args, **kwargs)
-            query_cache[query] = result
-            print("Query executed and result cached.")
+            yield from rows
+            return
+        kept = []
+        since = store.generation()
+        with tracing(conn) as statements:
+            for row in func(conn, *args, **kwargs):
+                if kept is not None:
+                    kept.append(row)
+                    if len(kept) > max_rows:
+                        kept = None  # Too large to cache; just stream it
+                yield row
+        if kept is not None:
+            tables = set().union(*map(tables_in, statements))
+            if store.set(key, kept, tables=tables, ttl=ttl,
+                         stale_ttl=stale_ttl, since=since):
+                print("Query executed and result cached.")
+    return wrapper
+
+
+def _async_stream_cache_query(func, store, make_key, ttl, stale_ttl, max_rows):
+    @functools.wraps(func)
+    async def wrapper(conn, *args, **kwargs):
+        key = make_key(await adatabase_identity(conn), conn, *args, **kwargs)
+        state, rows = store.lookup(key)
+        if state == FRESH:
+            print("Returning cached result.")
+            for row in rows:
+                yield row
+            return
+        kept = []
+        since = store.generation()
+        stream = func(conn, *args, **kwargs)
+        async with atracing(conn) as statements:
+            try:
+                async for row in stream:
+                    if kept is not None:
+                        kept.append(row)
+                        if len(kept) > max_rows:
+                            kept = None  # Too large to cache; just stream it
+                    yield row
+            finally:
+                await stream.aclose()
+        if kept is not None:
+            tables = set().union(*map(tables_in, statements))
+            if store.set(key, kept, tables=tables, ttl=ttl,
+                         stale_ttl=stale_ttl, since=since):
+                print("Query executed and result cached.")
+    return wrapper
+
+
+# Strong references to background refresh tasks, which the event loop
+# only holds weakly
+_refresh_tasks = set()
+
+
+def _async_cache_query(func, store, make_key, flights, ttl, stale_ttl,
+                       refresh_interval):
+    async def fill(conn, key, args, kwargs):
+        since = store.generation()
+        async with atracing(conn) as statements:
+            result = await func(conn, *args, **kwargs)
+        tables = set().union(*map(tables_in, statements))
+        store.set(key, result, tables=tables, ttl=ttl, stale_ttl=stale_ttl,
+                  since=since)
+        return result
+
+    async def refresh(key, args, kwargs):
+        try:
+            async with get_async_pool(key[0]).connection() as conn:
+                await flights.do_async(key, lambda: fill(conn, key, args, kwargs))
+        except Exception as e:
+            print(f"Background refresh failed: {e}")
+
+    @functools.wraps(func)
+    async def wrapper(conn, *args, **kwargs):
+        key = make_key(await adatabase_identity(conn), conn, *args, **kwargs)
+        state, result = store.lookup(key)
+        if state == FRESH:
+            print("Returning cached result.")
+            return result
+        if state == STALE:
+            if store.claim_refresh(key, refresh_interval):
+                task = asyncio.create_task(refresh(key, args, kwargs))
+                _refresh_tasks.add(task)
+                task.add_done_callback(_refresh_tasks.discard)
+            print("Returning stale result while it is refreshed.")
             return result
+        result = await flights.do_async(
+            key, lambda: fill(conn, key, args, kwargs)
+        )
+        print("Query executed and result cached.")
+        return result
     return wrapper
 
 @with_db_connection
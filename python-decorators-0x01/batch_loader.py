@@ -0,0 +1,87 @@
+import asyncio
+import functools
+import inspect
+
+
+class BatchLoader:
+    """Coalesce single-key lookups made in the same event-loop tick.
+
+    `await loader.load(key)` only queues the key; once the current tick
+    ends, every key queued in it is fetched with one call to
+    batch_fn(keys), which must return one value per key in the same
+    order (e.g. get_users_by_ids). Plain batch functions run in the
+    default executor so they don't block the loop. Batches are split at
+    `max_batch` keys.
+
+    Results are memoized per key for the life of the loader, so create
+    one per request or unit of work, or call clear().
+    """
+
+    def __init__(self, batch_fn, max_batch=None):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self._memo = {}  # key -> Future
+        self._queue = []  # (key, Future) waiting for the end of the tick
+        self._tasks = set()  # The loop only keeps weak references
+
+    async def load(self, key):
+        future = self._memo.get(key)
+        if future is None or future.cancelled():
+            loop = asyncio.get_running_loop()
+            future = self._memo[key] = loop.create_future()
+            if not self._queue:
+                loop.call_soon(self._dispatch)
+            self._queue.append((key, future))
+        # Other callers share the future: cancelling this one must not
+        # cancel theirs
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys):
+        return await asyncio.gather(*map(self.load, keys))
+
+    def clear(self, key=None):
+        """Forget the memoized result of `key`, or of every key."""
+        if key is None:
+            self._memo.clear()
+        else:
+            self._memo.pop(key, None)
+
+    def _dispatch(self):
+        queued, self._queue = self._queue, []
+        size = self.max_batch or len(queued)
+        for start in range(0, len(queued), size):
+            task = asyncio.ensure_future(self._fetch(queued[start:start + size]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, queued):
+        keys = [key for key, _ in queued]
+        futures = [future for _, future in queued]
+        try:
+            if inspect.iscoroutinefunction(self.batch_fn):
+                values = await self.batch_fn(keys)
+            else:
+                values = await asyncio.get_running_loop().run_in_executor(
+                    None, functools.partial(self.batch_fn, keys)
+                )
+            if len(values) != len(keys):
+                raise ValueError(
+                    f"batch function returned {len(values)} values for "
+                    f"{len(keys)} keys"
+                )
+        except BaseException as e:  # Including cancellation of this task
+            for key, future in queued:
+                if self._memo.get(key) is future:
+                    del self._memo[key]  # Don't memoize failures
+                if future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for future, value in zip(futures, values):
+            if not future.done():
+                future.set_result(value)
@@ -0,0 +1,131 @@
+"""Per-call overhead of db_call() against the stacked decorators.
+
+Usage: python3 bench_db_call.py [calls]
+
+Runs against a small users.db in a temporary directory. Each scenario
+times the same one-row query undecorated (on a held connection), through
+the stacked decorators and through the equivalent db_call(), and reports
+microseconds per call and the overhead over the undecorated call.
+
+On a cache hit the stacked form also prints a message and reads PRAGMA
+database_list to key the cache, which db_call() skips. That extra work is
+timed on its own and shown next to the stacked figure, along with the
+stacked time without it.
+"""
+import contextlib
+import importlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+QUERY = "SELECT * FROM users WHERE id = 1"
+
+
+def load(name):
+    """Import a task module; they run a short demo on import."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return importlib.import_module(name)
+
+
+def seed():
+    conn = sqlite3.connect("users.db")
+    conn.execute(
+        "CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT, age INTEGER)"
+    )
+    conn.executemany(
+        "INSERT INTO users (name, email, age) VALUES (?, ?, ?)",
+        [(f"user{i}", f"user{i}@example.com", 20 + i % 50) for i in range(100)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def per_call(fn, calls):
+    """Best of five runs, in microseconds per call."""
+    return min(timeit.repeat(fn, number=calls, repeat=5)) / calls * 1e6
+
+
+def main(calls=20000):
+    sys.path.insert(0, HERE)
+    os.chdir(tempfile.mkdtemp())
+    seed()
+
+    import query_log
+    from db_call import db_call
+    from db_pool import get_pool, with_db_connection
+    from query_cache import database_identity
+    log_queries = load("0-log_queries").log_queries
+    transactional = load("2-transactional").transactional
+    retry_on_failure = load("3-retry_on_failure").retry_on_failure
+    cache_query = load("4-cache_query").cache_query
+    # Keep log I/O out of the measurement; metrics are still recorded
+    query_log.SAMPLE_RATE = 0
+    query_log.SLOW_QUERY_MS = float("inf")
+
+    def make(name):
+        def fetch(conn, query):
+            return conn.execute(query).fetchall()
+        fetch.__qualname__ = name
+        return fetch
+
+    def hit_extras(conn):
+        # What cache_query does on a hit and db_call(cached=True) doesn't
+        print("Returning cached result.")
+        database_identity(conn)
+
+    # (name, stacked, fused, work only the stacked form does, or None)
+    scenarios = [
+        (
+            "connection",
+            with_db_connection(make("a")),
+            db_call(make("b")),
+            None,
+        ),
+        (
+            "connection+transaction+retry+log",
+            with_db_connection(transactional(retry_on_failure(retries=3, delay=0)(
+                log_queries(make("c"))))),
+            db_call(transactional=True, retries=3, delay=0, log=True)(make("d")),
+            None,
+        ),
+        (
+            "all five, cache hit",
+            with_db_connection(transactional(retry_on_failure(retries=3, delay=0)(
+                cache_query(log_queries(make("e")))))),
+            db_call(transactional=True, retries=3, delay=0, cached=True,
+                    log=True)(make("f")),
+            hit_extras,
+        ),
+    ]
+
+    bare = make("bare")
+    # cache_query prints on every hit; discard that output for both forms
+    with get_pool().connection() as conn, \
+            contextlib.redirect_stdout(io.StringIO()) as sink:
+        baseline = per_call(lambda: bare(conn, QUERY), calls)
+        results = []
+        for name, stacked, fused, extras in scenarios:
+            results.append((
+                name,
+                per_call(lambda: stacked(query=QUERY), calls),
+                per_call(lambda: fused(query=QUERY), calls),
+                extras and per_call(lambda: extras(conn), calls),
+            ))
+            sink.seek(0)
+            sink.truncate()
+    print(f"{'undecorated':36} {baseline:8.2f} us/call")
+    for name, stacked, fused, extra in results:
+        print(f"{name:36} stacked {stacked:8.2f} us (+{stacked - baseline:.2f})"
+              f"  db_call {fused:8.2f} us (+{fused - baseline:.2f})")
+        if extra:
+            print(f"{'':36} stacked does {extra:.2f} us/call of extra work"
+                  f" (print, PRAGMA database_list); without it"
+                  f" {stacked - extra:8.2f} us")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,165 @@
+import functools
+import inspect
+import time
+import retry_policy
+from db_pool import get_pool
+from group_commit import in_batch, savepoint
+from query_cache import (
+    FRESH, SingleFlight, default_cache, invalidate_tables,
+    key_builder, tables_in, tracing, written_tables
+)
+from query_log import call_params, caller, mark_internal, record_query
+
+mark_internal(__file__, retry_policy.__file__, inspect.getfile(get_pool),
+              inspect.getfile(savepoint))
+
+
+def db_call(func=None, *, database="users.db", transactional=False,
+            retries=1, delay=2, backoff="exponential", max_delay=30,
+            retry_on=None, retry_budget=retry_policy.budget, cached=False,
+            cache=None, ttl=None, log=False, sample_rate=None, slow_ms=None):
+    """Fused form of the decorator stack, in one wrapper.
+
+    Does what
+
+        @with_db_connection
+        @transactional
+        @retry_on_failure(retries, delay, backoff, ...)
+        @cache_query(ttl=ttl, cache=cache)
+        @log_queries(sample_rate=sample_rate, slow_ms=slow_ms)
+
+    does, with each layer switched on by its option. Only the enabled
+    stages are built, once, at decoration time; they pass the connection
+    and the call's args/kwargs along as plain values, so the arguments
+    are unpacked once, into `func` itself. `retries` counts attempts, as
+    in retry_on_failure, so the default of 1 means no retries.
+
+    With transactional=True inside a group_commit.batch() block, the
+    call runs in a savepoint of the batch's transaction, as with
+    @transactional. Only plain functions are supported: use the
+    individual decorators for coroutine and generator functions, group
+    commit and stale-while-revalidate caching.
+    """
+    if func is None:
+        return functools.partial(
+            db_call, database=database, transactional=transactional,
+            retries=retries, delay=delay, backoff=backoff,
+            max_delay=max_delay, retry_on=retry_on,
+            retry_budget=retry_budget, cached=cached, cache=cache, ttl=ttl,
+            log=log, sample_rate=sample_rate, slow_ms=slow_ms
+        )
+    if (inspect.iscoroutinefunction(func) or inspect.isgeneratorfunction(func)
+            or inspect.isasyncgenfunction(func)):
+        raise TypeError("db_call only supports plain functions")
+    if backoff not in retry_policy.BACKOFFS:
+        raise ValueError(f"Unknown backoff strategy {backoff!r}")
+
+    def run(conn, args, kwargs):
+        return func(conn, *args, **kwargs)
+
+    stage = run
+    if log:
+        name = func.__qualname__
+        signature = inspect.signature(func)
+
+        def logged(conn, args, kwargs):
+            query = kwargs.get("query") or (args[0] if args else None)
+            if not isinstance(query, str):
+                query = None
+
+            def params():  # Only bound if the record is logged
+                return call_params(signature, (conn, *args), kwargs)
+
+            started = time.perf_counter()
+            try:
+                result = func(conn, *args, **kwargs)
+            except Exception as e:
+                record_query(query, time.perf_counter() - started,
+                             params=params, caller=caller(), error=e,
+                             sample_rate=sample_rate, slow_ms=slow_ms,
+                             name=name)
+                raise
+            record_query(query, time.perf_counter() - started,
+                         rows=len(result) if isinstance(result, list) else None,
+                         params=params, caller=caller(),
+                         sample_rate=sample_rate, slow_ms=slow_ms, name=name)
+            return result
+        stage = logged
+
+    pool = get_pool(database)
+
+    if cached:
+        store = default_cache if cache is None else cache
+        make_key = key_builder(func)
+        flights = SingleFlight()
+        fetch = stage
+
+        def fill(conn, key, args, kwargs):
+            since = store.generation()
+            with tracing(conn) as statements:
+                result = fetch(conn, args, kwargs)
+            tables = set().union(*map(tables_in, statements))
+            store.set(key, result, tables=tables, ttl=ttl, since=since)
+            return result
+
+        def cached_stage(conn, args, kwargs):
+            # Every connection comes from `pool`, so its database is known
+            key = make_key(pool.database, conn, *args, **kwargs)
+            state, result = store.lookup(key)
+            if state == FRESH:
+                return result
+            return flights.do(key, lambda: fill(conn, key, args, kwargs))
+        stage = cached_stage
+
+    if retries > 1:
+        retryable = retry_policy.classifier(retry_on)
+        attempt = stage
+
+        def retried(conn, args, kwargs):
+            return retry_policy.call(
+                lambda: attempt(conn, args, kwargs), retries, delay, backoff,
+                max_delay, retryable, retry_budget
+            )
+        stage = retried
+
+    if transactional:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            conn = pool.acquire()
+            try:
+                if in_batch(conn):
+                    # The batch commits; only undo this call on error
+                    with savepoint(conn):
+                        return stage(conn, args, kwargs)
+                try:
+                    with tracing(conn) as statements:
+                        result = stage(conn, args, kwargs)
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    print(f"Transaction failed: {e}")
+                    raise
+            finally:
+                pool.release(conn)
+            invalidate_tables(written_tables(statements))
+            return result
+        return wrapper
+
+    if stage is run:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            conn = pool.acquire()
+            try:
+                return func(conn, *args, **kwargs)
+            finally:
+                pool.release(conn)
+        return wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        conn = pool.acquire()
+        try:
+            return stage(conn, args, kwargs)
+        finally:
+            pool.release(conn)
+    return wrapper
@@ -0,0 +1,370 @@
+import asyncio
+import functools
+import inspect
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    import aiosqlite
+except ImportError:  # Only needed for coroutine functions
+    aiosqlite = None
+
+# Applied to every new connection.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # KiB, i.e. 16 MB of page cache
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+# Rows fetched per fetchmany() call by iter_rows().
+STREAM_BATCH_SIZE = 500
+
+# Most ? parameters in one statement on SQLite builds older than 3.32,
+# for Pythons that cannot ask (Connection.getlimit() is 3.11+).
+DEFAULT_VARIABLE_LIMIT = 999
+
+# Statements held in a connection's cache, from the sqlite_stmt virtual
+# table (needs SQLite built with SQLITE_ENABLE_STMTVTAB).
+STATEMENTS_QUERY = """
+SELECT sql, run, reprep, mem FROM sqlite_stmt
+WHERE sql NOT LIKE '%sqlite_stmt%'
+"""
+
+
+def statement_stats(conn):
+    """List the prepared statements cached on `conn`.
+
+    Returns dicts with the SQL text, how often it ran, how often it had
+    to be re-prepared and its memory use, or None if this SQLite build
+    has no sqlite_stmt table.
+    """
+    try:
+        rows = conn.execute(STATEMENTS_QUERY).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    return [dict(zip(("sql", "runs", "reprepares", "bytes"), row))
+            for row in rows]
+
+
+def iter_rows(cursor, batch_size=STREAM_BATCH_SIZE):
+    """Yield the rows of an executed cursor, fetching `batch_size` at a time.
+
+    Only one batch is held in memory, however large the result set.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def variable_limit(conn):
+    """Return how many ? parameters one statement on `conn` may have."""
+    try:
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    except AttributeError:
+        return DEFAULT_VARIABLE_LIMIT
+
+
+class SQLitePool:
+    """Reusable SQLite connections, kept per thread.
+
+    sqlite3 connections may only be used by the thread that opened them,
+    so each thread keeps up to `size` idle connections of its own. New
+    connections get `pragmas` applied once; returned connections have any
+    open transaction rolled back, and their row and text factories,
+    isolation level and trace callback set back to the defaults.
+
+    Each connection keeps up to `cached_statements` prepared statements,
+    so once a connection is warm, repeated queries skip the prepare step.
+    """
+
+    def __init__(self, database="users.db", size=4, pragmas=None, timeout=5.0,
+                 cached_statements=256):
+        self.database = database
+        self.size = size
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+
+    def _idle(self):
+        idle = getattr(self._local, "idle", None)
+        if idle is None:
+            idle = self._local.idle = []
+        return idle
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.timeout,
+            cached_statements=self.cached_statements,
+        )
+        # executescript() keeps the PRAGMAs out of the statement cache
+        conn.executescript("".join(
+            f"PRAGMA {name} = {value};" for name, value in self.pragmas.items()
+        ))
+        return conn
+
+    def acquire(self):
+        """Check out an idle connection of this thread, or open one."""
+        pinned = getattr(self._local, "pinned", None)
+        if pinned is not None:
+            return pinned
+        idle = self._idle()
+        return idle.pop() if idle else self._connect()
+
+    def release(self, conn):
+        """Reset a connection and keep it for reuse, or close it."""
+        if conn is getattr(self._local, "pinned", None):
+            return
+        idle = self._idle()
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            # Don't hand the next borrower this one's settings
+            conn.row_factory = None
+            conn.text_factory = str
+            conn.isolation_level = ""
+            conn.set_trace_callback(None)
+        except sqlite3.Error:
+            conn.close()
+            return
+        if len(idle) < self.size:
+            idle.append(conn)
+        else:
+            conn.close()
+
+    def statement_stats(self):
+        """statement_stats() of each idle connection of this thread."""
+        return [statement_stats(conn) for conn in self._idle()]
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def pinned(self):
+        """Hand the same connection to every checkout in this thread.
+
+        Used to run several decorated calls on one connection, e.g. in a
+        transaction batch. Nested blocks share the outer connection.
+        """
+        pinned = getattr(self._local, "pinned", None)
+        if pinned is not None:
+            yield pinned
+            return
+        conn = self.acquire()
+        self._local.pinned = conn
+        try:
+            yield conn
+        finally:
+            self._local.pinned = None
+            self.release(conn)
+
+
+class AsyncSQLitePool:
+    """Reusable aiosqlite connections for coroutine functions.
+
+    The async counterpart of SQLitePool: same PRAGMAs and statement cache
+    size on new connections, and the same reset when they are returned,
+    except that connections whose isolation level changed are closed.
+    Idle connections are kept per event loop and closed when it shuts
+    down: asyncio.run() does this on its own, other loops should await
+    aclose() before stopping. Each aiosqlite connection has a worker
+    thread that would otherwise keep the process from exiting.
+    """
+
+    def __init__(self, database="users.db", size=4, pragmas=None, timeout=5.0,
+                 cached_statements=256):
+        self.database = database
+        self.size = size
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        # Per event loop: idle connections, or None once it is shutting down
+        self._idle = weakref.WeakKeyDictionary()
+        self._closers = weakref.WeakKeyDictionary()  # loop -> shutdown task
+
+    def _loop_idle(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._idle:
+            self._idle[loop] = []
+            self._closers[loop] = loop.create_task(self._close_at_shutdown(loop))
+        return self._idle[loop]
+
+    async def _close_at_shutdown(self, loop):
+        try:
+            # asyncio.run() cancels leftover tasks when the main one ends
+            await loop.create_future()
+        finally:
+            if self._closers.pop(loop, None) is not None:  # Not aclose()
+                idle, self._idle[loop] = self._idle.get(loop) or [], None
+                for conn in idle:
+                    await conn.close()
+
+    async def _connect(self):
+        if aiosqlite is None:
+            raise RuntimeError("aiosqlite is required for async database functions")
+        conn = await aiosqlite.connect(
+            self.database,
+            timeout=self.timeout,
+            cached_statements=self.cached_statements,
+        )
+        await conn.executescript("".join(
+            f"PRAGMA {name} = {value};" for name, value in self.pragmas.items()
+        ))
+        return conn
+
+    async def acquire(self):
+        idle = self._loop_idle()
+        return idle.pop() if idle else await self._connect()
+
+    async def release(self, conn):
+        idle = self._loop_idle()
+        if idle is None:  # The loop is shutting down
+            await conn.close()
+            return
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+            # aiosqlite can't set isolation_level off the connection's
+            # own thread, so a changed one is closed instead of reset
+            if conn.isolation_level != "":
+                await conn.close()
+                return
+            conn.row_factory = None
+            conn.text_factory = str
+            await conn.set_trace_callback(None)
+        except sqlite3.Error:
+            await conn.close()
+            return
+        if len(idle) < self.size:
+            idle.append(conn)
+        else:
+            await conn.close()
+
+    async def aclose(self):
+        """Close the idle connections of the running event loop."""
+        loop = asyncio.get_running_loop()
+        closer = self._closers.pop(loop, None)
+        if closer is not None:
+            closer.cancel()
+        for conn in self._idle.pop(loop, None) or ():
+            await conn.close()
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+
+# Keyword arguments accepted by configure_pool()
+POOL_OPTIONS = ("size", "pragmas", "timeout", "cached_statements")
+
+_pools = {}
+_pool_options = {}  # database -> options for its pools
+_pools_lock = threading.Lock()
+
+
+def _pool_database(database):
+    return database if database == ":memory:" else os.path.abspath(database)
+
+
+def _shared_pool(pool_class, database):
+    database = _pool_database(database)
+    with _pools_lock:
+        pool = _pools.get((pool_class, database))
+        if pool is None:
+            pool = _pools[pool_class, database] = pool_class(
+                database, **_pool_options.get(database, {})
+            )
+        return pool
+
+
+def configure_pool(database="users.db", **options):
+    """Change the settings of the shared pools for `database`.
+
+    Takes any of POOL_OPTIONS and applies them to the sqlite3 and the
+    aiosqlite pool alike, including pools already handed out (decorators
+    fetch theirs when they wrap a function). Connections already open
+    keep their old settings.
+    """
+    unknown = sorted(set(options) - set(POOL_OPTIONS))
+    if unknown:
+        raise TypeError(f"Unknown pool options: {', '.join(unknown)}")
+    if options.get("pragmas", ()) is None:
+        options["pragmas"] = DEFAULT_PRAGMAS
+    database = _pool_database(database)
+    with _pools_lock:
+        _pool_options.setdefault(database, {}).update(options)
+        for (_, pool_database), pool in _pools.items():
+            if pool_database == database:
+                for name, value in options.items():
+                    setattr(pool, name, value)
+
+
+def get_pool(database="users.db"):
+    """Return the shared pool for `database`."""
+    return _shared_pool(SQLitePool, database)
+
+
+def get_async_pool(database="users.db"):
+    """Return the shared aiosqlite pool for `database`."""
+    return _shared_pool(AsyncSQLitePool, database)
+
+
+# Decorator to hand a pooled connection to the wrapped function;
+# coroutine functions get an aiosqlite connection, and (async) generator
+# functions keep theirs until the generator is exhausted or closed
+def with_db_connection(func):
+    if inspect.isasyncgenfunction(func):
+        async_pool = get_async_pool()
+
+        @functools.wraps(func)
+        async def agen_wrapper(*args, **kwargs):
+            async with async_pool.connection() as conn:
+                rows = func(conn, *args, **kwargs)
+                try:
+                    async for row in rows:
+                        yield row
+                finally:
+                    # Close it while the connection is still checked out
+                    await rows.aclose()
+        return agen_wrapper
+
+    if inspect.iscoroutinefunction(func):
+        async_pool = get_async_pool()
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            async with async_pool.connection() as conn:
+                return await func(conn, *args, **kwargs)
+        return async_wrapper
+
+    pool = get_pool()
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            with pool.connection() as conn:
+                yield from func(conn, *args, **kwargs)
+        return gen_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with pool.connection() as conn:
+            # Pass connection as the first argument to the wrapped function
+            return func(conn, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,160 @@
+import itertools
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from db_pool import get_pool
+from query_cache import invalidate_tables, tracing, written_tables
+
+_savepoint_ids = itertools.count()
+
+# Connections currently inside a batch() block.
+_batched = set()
+
+
+@contextmanager
+def savepoint(conn):
+    """Run the block in a savepoint, undoing only its changes on error."""
+    name = f"sp_{next(_savepoint_ids)}"
+    conn.execute(f"SAVEPOINT {name}")
+    try:
+        yield
+    except BaseException:
+        conn.execute(f"ROLLBACK TO {name}")
+        conn.execute(f"RELEASE {name}")
+        raise
+    conn.execute(f"RELEASE {name}")
+
+
+def in_batch(conn):
+    return id(conn) in _batched
+
+
+@contextmanager
+def batch(database="users.db"):
+    """Commit every transactional call made in this thread as one transaction.
+
+    Decorated calls inside the block share a pinned connection and each
+    runs in its own savepoint: a failing call rolls back just its changes
+    and raises to its caller, and the rest commit together when the block
+    exits. If the block itself raises, everything is rolled back.
+    """
+    with get_pool(database).pinned() as conn:
+        if in_batch(conn):  # Nested batch: the outer block commits
+            yield conn
+            return
+        _batched.add(id(conn))
+        try:
+            with tracing(conn) as statements:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN")
+                yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            _batched.discard(id(conn))
+        invalidate_tables(written_tables(statements))
+
+
+class GroupCommitter:
+    """Funnel transactional calls from many threads into shared commits.
+
+    Calls are queued to one writer thread, which gathers whatever arrives
+    within `window` seconds (up to `max_batch` calls), runs each in its
+    own savepoint on its connection and commits them together. Every
+    caller blocks until that commit and gets its own result or error.
+
+    Calls submitted from the writer thread itself (a group-commit function
+    calling another) run inline, in a savepoint of the batch in progress.
+    """
+
+    def __init__(self, database="users.db", window=0.002, max_batch=256):
+        self.database = database
+        self.window = window
+        self.max_batch = max_batch
+        self._calls = queue.SimpleQueue()
+        self._thread = None
+        self._conn = None  # The writer thread's connection
+        self._lock = threading.Lock()
+
+    def submit(self, func, args, kwargs):
+        """Run func(conn, *args, **kwargs) in the next group commit."""
+        if threading.current_thread() is self._thread:
+            # Queueing would wait on the only thread that can commit it
+            with savepoint(self._conn):
+                return func(self._conn, *args, **kwargs)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="group-commit", daemon=True
+                )
+                self._thread.start()
+        future = Future()
+        self._calls.put((func, args, kwargs, future))
+        return future.result()
+
+    def _gather(self):
+        calls = [self._calls.get()]
+        deadline = time.monotonic() + self.window
+        while len(calls) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                calls.append(self._calls.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return calls
+
+    def _run(self):
+        with get_pool(self.database).connection() as conn:
+            self._conn = conn
+            while True:
+                self._commit(conn, self._gather())
+
+    def _commit(self, conn, calls):
+        outcomes = []
+        try:
+            with tracing(conn) as statements:
+                conn.execute("BEGIN")
+                for func, args, kwargs, future in calls:
+                    try:
+                        with savepoint(conn):
+                            outcomes.append((future, func(conn, *args, **kwargs), None))
+                    except BaseException as e:  # Must not kill the writer
+                        outcomes.append((future, None, e))
+                conn.commit()
+        except BaseException as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            done = {id(future) for future, _, _ in outcomes}
+            for future, _, error in outcomes:
+                future.set_exception(error or e)
+            for _, _, _, future in calls:
+                if id(future) not in done:
+                    future.set_exception(e)
+            return
+        invalidate_tables(written_tables(statements))
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_committers = {}
+_committers_lock = threading.Lock()
+
+
+def committer(database="users.db"):
+    """Return the shared GroupCommitter for `database`."""
+    with _committers_lock:
+        if database not in _committers:
+            _committers[database] = GroupCommitter(database)
+        return _committers[database]
@@ -0,0 +1,512 @@
+import asyncio
+import inspect
+import os
+import re
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+# Tables a statement reads from or writes to.
+TABLE_PATTERN = re.compile(
+    r'\b(?:FROM|JOIN|INTO|UPDATE(?:\s+OR\s+\w+)?)\s+["`\[]?(\w+)', re.IGNORECASE
+)
+WRITE_PATTERN = re.compile(
+    r'^\s*(?:INSERT|REPLACE|UPDATE|DELETE)\b', re.IGNORECASE
+)
+# Quoted literals and identifiers, which normalization must leave alone.
+QUOTED_PATTERN = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+# Arguments treated as SQL text when building cache keys.
+SQL_ARGUMENTS = ("query", "sql")
+
+# Every QueryCache, so a write can invalidate all of them.
+_caches = weakref.WeakSet()
+
+# Per-connection statement collectors installed by tracing().
+_tracers = {}
+
+# Bumped by every invalidate_tables(); each table remembers the value of
+# its last invalidation, so a result read before a write can be spotted.
+_generation = 0
+_table_generations = {}
+_generation_lock = threading.Lock()
+
+
+def tables_in(sql):
+    """Return the lower-cased table names a SQL statement refers to."""
+    return {table.lower() for table in TABLE_PATTERN.findall(sql)}
+
+
+def written_tables(statements):
+    """Return the tables modified by any of `statements`."""
+    tables = set()
+    for sql in statements:
+        if WRITE_PATTERN.match(sql):
+            tables |= tables_in(sql)
+    return tables
+
+
+def _attach(conn, collect):
+    """Register `collect`; return the trace callback to install, if any."""
+    collectors = _tracers.setdefault(id(conn), [])
+    collectors.append(collect)
+    if len(collectors) > 1:
+        return None
+
+    def trace(sql):
+        for each in collectors:
+            each(sql)
+    return trace
+
+
+def _detach(conn, collect):
+    """Unregister `collect`; return True if the callback should go."""
+    collectors = _tracers[id(conn)]
+    collectors.remove(collect)
+    if collectors:
+        return False
+    del _tracers[id(conn)]
+    return True
+
+
+@contextmanager
+def tracing(conn):
+    """Collect the SQL of every statement run on `conn` inside the block.
+
+    Blocks may be nested on the same connection; each sees the statements
+    executed while it was open.
+    """
+    statements = []
+    trace = _attach(conn, statements.append)
+    if trace is not None:
+        conn.set_trace_callback(trace)
+    try:
+        yield statements
+    finally:
+        if _detach(conn, statements.append):
+            conn.set_trace_callback(None)
+
+
+@asynccontextmanager
+async def atracing(conn):
+    """tracing() for an aiosqlite connection."""
+    statements = []
+    trace = _attach(conn, statements.append)
+    if trace is not None:
+        await conn.set_trace_callback(trace)
+    try:
+        yield statements
+    finally:
+        if _detach(conn, statements.append):
+            await conn.set_trace_callback(None)
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and letter case outside quoted literals."""
+    parts = QUOTED_PATTERN.split(sql.strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i]).lower()
+    return "".join(parts)
+
+
+def _main_database(rows):
+    for _, name, path in rows:
+        if name == "main":
+            return path or ":memory:"
+    return None
+
+
+def database_identity(conn):
+    """Return the file backing the connection's main database."""
+    return _main_database(conn.execute("PRAGMA database_list"))
+
+
+async def adatabase_identity(conn):
+    """database_identity() for an aiosqlite connection."""
+    async with conn.execute("PRAGMA database_list") as cursor:
+        return _main_database(await cursor.fetchall())
+
+
+def _freeze(value):
+    """Turn argument values into something hashable."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        # Sorted, not a frozenset: keys are pickled for the shared cache,
+        # and a set's pickle follows its hash order, which differs between
+        # processes. Tagged so it doesn't collide with an equal tuple.
+        items = [_freeze(item) for item in value]
+        try:
+            items.sort()
+        except TypeError:  # Mixed types
+            items.sort(key=repr)
+        return (frozenset, tuple(items))
+    return value
+
+
+def key_builder(func):
+    """Return a function building cache keys for calls to `func(conn, ...)`.
+
+    The returned make_key(database, conn, *args, **kwargs) takes the
+    database_identity() of `conn` separately, since reading it is async
+    for aiosqlite connections. A key combines the database file, the
+    function, the normalized SQL text and every bound argument, so
+    different parameters never share an entry and equivalent SQL
+    spellings do.
+    """
+    signature = inspect.signature(func)
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    def make_key(database, conn, *args, **kwargs):
+        bound = signature.bind(conn, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = list(bound.arguments.items())[1:]  # Skip the connection
+        key = [database, name]
+        for argument, value in arguments:
+            if argument in SQL_ARGUMENTS and isinstance(value, str):
+                value = normalize_sql(value)
+            key.append((argument, _freeze(value)))
+        return tuple(key)
+    return make_key
+
+
+def generation():
+    """Return the current invalidation generation of this process.
+
+    QueryCache.generation() pairs it with the shared store's, for
+    QueryCache.set(since=).
+    """
+    return _generation
+
+
+def changed_since(tables, since):
+    """True if any of `tables` was invalidated after generation `since`."""
+    return any(_table_generations.get(table, 0) > since for table in tables)
+
+
+def invalidate_tables(tables):
+    """Drop cached results that depend on any of `tables`, in every cache."""
+    global _generation
+    tables = {table.lower() for table in tables}
+    if tables:
+        with _generation_lock:
+            _generation += 1
+            for table in tables:
+                _table_generations[table] = _generation
+        for cache in list(_caches):
+            cache.invalidate_tables(tables)
+
+
+def _sizeof(value):
+    """Rough size in bytes of a result set (a list of row tuples)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for row in value:
+            size += sys.getsizeof(row)
+            if isinstance(row, tuple):
+                size += sum(sys.getsizeof(field) for field in row)
+    return size
+
+
+class _Abandoned(Exception):
+    """A flight's leader was cancelled; its waiters start the call again."""
+
+
+class SingleFlight:
+    """Coalesce concurrent computations of the same key.
+
+    The first caller for a key runs the computation; callers that arrive
+    while it is in flight wait for it and share its result or exception.
+    Nothing is kept once the call finishes, so errors are never cached.
+    Cancellation is not shared: if the leading coroutine is cancelled,
+    one of its waiters takes over the call, and a cancelled waiter just
+    stops waiting.
+    Threads and coroutines can wait on the same flight, but a thread must
+    not block on a flight led by a coroutine on its own event loop.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """Return (future, leader) for the flight computing `key`."""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                return future, False
+            future = self._flights[key] = Future()
+            return future, True
+
+    def _land(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._flights[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn):
+        """Return fn(), sharing one call among concurrent callers of `key`."""
+        future, leader = self._join(key)
+        while not leader:
+            try:
+                return future.result()
+            except _Abandoned:
+                future, leader = self._join(key)
+        try:
+            result = fn()
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result)
+        return result
+
+    async def do_async(self, key, fn):
+        """Like do(), for a coroutine function `fn`."""
+        future, leader = self._join(key)
+        while not leader:
+            try:
+                # Shielded: cancelling this waiter must not cancel the flight
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _Abandoned:
+                future, leader = self._join(key)
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self._land(key, future, error=_Abandoned())
+            raise
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result)
+        return result
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "stale_until", "tables", "size",
+                 "refreshed")
+
+    def __init__(self, value, expires, stale_until, tables, size):
+        self.value = value
+        self.expires = expires
+        self.stale_until = stale_until
+        self.tables = tables
+        self.size = size
+        self.refreshed = 0.0
+
+
+# lookup() states
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+
+class QueryCache:
+    """Thread-safe LRU cache of query results.
+
+    Bounded by `max_entries` and, optionally, `max_bytes` (estimated);
+    every entry expires `ttl` seconds after it was stored, and may then be
+    served stale for `stale_ttl` more seconds while it is refreshed.
+    Entries remember the tables they were read from so writes to those
+    tables evict them.
+
+    With `l2` (a shared_cache.SharedCacheStore), stored entries are also
+    written to a store shared with other processes, and local misses are
+    looked up there before the caller runs the query.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=300, l2=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.l2 = l2
+        self._entries = OrderedDict()  # key -> _Entry
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        _caches.add(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key).size
+
+    def lookup(self, key):
+        """Return (state, value) for `key`; state is FRESH, STALE or MISS."""
+        state, value = self._lookup_local(key)
+        if state == MISS and self.l2 is not None:
+            return self._lookup_l2(key)
+        return state, value
+
+    def _lookup_l2(self, key):
+        found = self.l2.get(key)
+        if found is None:
+            return MISS, None
+        value, expires, stale_until, tables = found
+        # The store keeps wall-clock times; entries use the monotonic clock
+        now = time.monotonic()
+        offset = now - time.time()
+        self._store(key, value, expires + offset, stale_until + offset, tables)
+        with self._lock:
+            self.misses -= 1  # Counted by the local lookup
+            self.l2_hits += 1
+        return (FRESH if expires + offset > now else STALE), value
+
+    def _lookup_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISS, None
+            now = time.monotonic()
+            if entry.expires <= now:
+                if entry.stale_until > now:
+                    self.stale_hits += 1
+                    return STALE, entry.value
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return MISS, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return FRESH, entry.value
+
+    def get(self, key):
+        """Return (hit, value) for `key`, counting stale entries as misses."""
+        state, value = self.lookup(key)
+        if state == FRESH:
+            return True, value
+        return False, None
+
+    def claim_refresh(self, key, interval):
+        """Return True if `key` was not refreshed in the last `interval` s."""
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is None or now - entry.refreshed < interval:
+                return False
+            entry.refreshed = now
+            return True
+
+    def generation(self):
+        """Return the invalidation generations to pass to set(since=).
+
+        Read it before running the query whose result will be stored.
+        """
+        return generation(), None if self.l2 is None else self.l2.generation()
+
+    def set(self, key, value, tables=(), ttl=None, stale_ttl=0, since=None):
+        """Store `value` under `key`, evicting least recently used entries.
+
+        With `since` (a generation() read before the query ran), nothing
+        is stored if one of `tables` has been invalidated since then, as
+        `value` may predate that write; in the shared store this covers
+        writes by other processes too. Returns whether it was stored
+        locally.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        tables = frozenset(table.lower() for table in tables)
+        expires = time.monotonic() + ttl
+        local_since, l2_since = (None, None) if since is None else since
+        if not self._store(key, value, expires, expires + stale_ttl, tables,
+                           local_since):
+            return False
+        # A shared generation that could not be read can't be checked
+        if self.l2 is not None and (since is None or l2_since is not None):
+            wall_expires = time.time() + ttl
+            self.l2.set(key, value, wall_expires, wall_expires + stale_ttl,
+                        tables, since=l2_since)
+        return True
+
+    def _store(self, key, value, expires, stale_until, tables, since=None):
+        size = _sizeof(value) if self.max_bytes else 0
+        with self._lock:
+            # Checked under the lock: invalidate_tables() bumps the
+            # generation before it takes the lock to drop entries
+            if since is not None and changed_since(tables, since):
+                return False
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _Entry(value, expires, stale_until, tables, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes and self._bytes > self.max_bytes
+                and len(self._entries) > 1
+            ):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def invalidate_tables(self, tables):
+        """Drop every entry read from one of `tables`."""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if entry.tables & tables]
+            for key in stale:
+                self._drop(key)
+            self.invalidations += len(stale)
+        if self.l2 is not None:
+            self.l2.invalidate_tables(tables)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.l2 is not None:
+            self.l2.clear()
+
+    def stats(self):
+        """Hit/miss/eviction counters and current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "l2_hits": self.l2_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+def _default_l2():
+    path = os.environ.get("QUERY_CACHE_L2")
+    if not path:
+        return None
+    from shared_cache import SharedCacheStore
+    return SharedCacheStore(path)
+
+
+# Cache used by cache_query unless another one is given; set
+# QUERY_CACHE_L2 to a file path to share it between processes.
+default_cache = QueryCache(l2=_default_l2())
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def refresh_executor():
+    """Return the shared worker pool for background cache refreshes."""
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="cache-refresh"
+            )
+        return _refresher
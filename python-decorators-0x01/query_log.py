@@ -0,0 +1,179 @@
+import atexit
+import functools
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timezone
+from query_cache import QUOTED_PATTERN, SQL_ARGUMENTS, normalize_sql
+from query_metrics import registry
+
+# Defaults for log_queries; override per decorator or via the environment.
+SAMPLE_RATE = float(os.environ.get("QUERY_LOG_SAMPLE_RATE", 1.0))
+SLOW_QUERY_MS = float(os.environ.get("QUERY_LOG_SLOW_MS", 100))
+
+NUMBER_PATTERN = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LIST_PATTERN = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+logger = logging.getLogger("query_log")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+
+_queue = queue.SimpleQueue()
+_listener = None
+_listener_lock = threading.Lock()
+
+# Files of the decorator modules, whose frames caller() skips.
+_internal_files = {__file__, normalize_sql.__code__.co_filename}
+
+
+class JSONFormatter(logging.Formatter):
+    """Format query records as one JSON object per line."""
+
+    def format(self, record):
+        entry = dict(getattr(record, "query", {}))
+        entry["time"] = datetime.fromtimestamp(
+            record.created, timezone.utc
+        ).isoformat()
+        entry["level"] = record.levelname
+        return json.dumps(entry, default=str)
+
+
+def start(handler=None):
+    """Write query records from a background thread to `handler`.
+
+    Defaults to JSON lines on stdout. The decorated call only puts a
+    record on an in-memory queue; formatting and I/O happen on the
+    listener thread.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        if handler is None:
+            handler = logging.StreamHandler(sys.stdout)
+        if handler.formatter is None:
+            handler.setFormatter(JSONFormatter())
+        logger.addHandler(logging.handlers.QueueHandler(_queue))
+        _listener = logging.handlers.QueueListener(_queue, handler)
+        _listener.start()
+        atexit.register(stop)
+
+
+def stop():
+    """Flush pending records and stop the listener thread."""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        logger.handlers.clear()
+        _listener = None
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalize `sql` with its literal values replaced by ?."""
+    parts = QUOTED_PATTERN.split(normalize_sql(sql))
+    for i in range(1, len(parts), 2):
+        if parts[i].startswith("'"):
+            parts[i] = "?"
+    text = NUMBER_PATTERN.sub("?", "".join(parts))
+    return IN_LIST_PATTERN.sub("(?+)", text)
+
+
+def mark_internal(*paths):
+    """Have caller() skip frames from the modules at `paths`.
+
+    Decorator modules register themselves and the helpers they call
+    through, so records name the code that made the call rather than
+    the wrapper stack in between.
+    """
+    _internal_files.update(paths)
+
+
+def caller(depth=1):
+    """Return the first frame above `depth` that is not decorator code.
+
+    Module-level code is never skipped, so calls made by a task script
+    at import time are still attributed to it.
+    """
+    frame = sys._getframe(depth + 1)
+    while (frame.f_back is not None
+           and frame.f_code.co_filename in _internal_files
+           and frame.f_code.co_name != "<module>"):
+        frame = frame.f_back
+    return frame
+
+
+def _is_connection(value):
+    return (isinstance(value, sqlite3.Connection)
+            or type(value).__module__.split(".")[0] == "aiosqlite")
+
+
+def call_params(signature, args, kwargs):
+    """Arguments of a call other than its connection and SQL text."""
+    try:
+        bound = signature.bind(*args, **kwargs)
+    except TypeError:
+        return None
+    return {name: value for name, value in bound.arguments.items()
+            if name not in SQL_ARGUMENTS and not _is_connection(value)}
+
+
+def fingerprint_id(text):
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def params_hash(params):
+    """Short stable hash of bound parameters, so values aren't logged."""
+    if not params:
+        return None
+    return hashlib.blake2b(repr(params).encode(), digest_size=8).hexdigest()
+
+
+def record_query(sql, seconds, rows=None, params=None, caller=None,
+                 error=None, sample_rate=None, slow_ms=None, name=None):
+    """Record one query in the metrics registry and maybe log it.
+
+    Every call is counted in query_metrics.registry under its fingerprint
+    (or `name` when there is no SQL text). A structured record is queued
+    for slow (at least `slow_ms`) and failed queries, and for the rest
+    with probability `sample_rate`. `caller` is the frame that made the
+    call. `params` may be a function returning them, called only if the
+    record is logged.
+    """
+    text = fingerprint(sql) if sql else name
+    registry.observe(text, seconds, rows, error is not None)
+    sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    slow_ms = SLOW_QUERY_MS if slow_ms is None else slow_ms
+    ms = seconds * 1000
+    slow = ms >= slow_ms
+    if not (slow or error is not None or random.random() < sample_rate):
+        return
+    if _listener is None:
+        start()
+    entry = {
+        "fingerprint": text,
+        "fingerprint_id": fingerprint_id(text) if text else None,
+        "duration_ms": round(ms, 3),
+        "rows": rows,
+        "params_hash": params_hash(params() if callable(params) else params),
+        "caller": (f"{caller.f_code.co_filename}:{caller.f_lineno}"
+                   f" in {caller.f_code.co_name}") if caller else None,
+        "slow": slow,
+    }
+    if error is not None:
+        entry["error"] = f"{type(error).__name__}: {error}"
+        logger.error("query failed", extra={"query": entry})
+    elif slow:
+        logger.warning("slow query", extra={"query": entry})
+    else:
+        logger.info("query", extra={"query": entry})
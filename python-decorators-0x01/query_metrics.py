@@ -0,0 +1,141 @@
+import bisect
+import json
+import threading
+
+# Upper bounds in seconds of the latency buckets: 10 us to ~84 s,
+# four buckets per doubling.
+BUCKETS = tuple(0.00001 * 2 ** (i / 4) for i in range(93))
+
+
+class Histogram:
+    """Log-bucketed latency histogram."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class QueryStats:
+    __slots__ = ("calls", "errors", "rows", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.latency = Histogram()
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """Per-fingerprint call, error, row and latency statistics."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def observe(self, fingerprint, seconds, rows=None, error=False):
+        with self._lock:
+            stats = self._stats.get(fingerprint)
+            if stats is None:
+                stats = self._stats[fingerprint] = QueryStats()
+            stats.calls += 1
+            stats.errors += bool(error)
+            stats.rows += rows or 0
+            stats.latency.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self):
+        """Summary per fingerprint, slowest total time first."""
+        with self._lock:
+            items = [(fingerprint, stats.calls, stats.errors, stats.rows,
+                      stats.latency.sum, stats.latency.max,
+                      [stats.latency.quantile(q) for q in (0.5, 0.9, 0.99)])
+                     for fingerprint, stats in self._stats.items()]
+        items.sort(key=lambda item: item[4], reverse=True)
+        return [
+            {
+                "fingerprint": fingerprint,
+                "calls": calls,
+                "errors": errors,
+                "rows": rows,
+                "total_seconds": total,
+                "max_seconds": slowest,
+                "p50_seconds": p50,
+                "p90_seconds": p90,
+                "p99_seconds": p99,
+            }
+            for fingerprint, calls, errors, rows, total, slowest, (p50, p90, p99)
+            in items
+        ]
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        """Render the registry in the Prometheus text exposition format."""
+        lines = [
+            "# HELP db_query_duration_seconds Query latency by fingerprint.",
+            "# TYPE db_query_duration_seconds histogram",
+        ]
+        totals = []
+        with self._lock:
+            for fingerprint, stats in self._stats.items():
+                label = f'query="{_label(fingerprint)}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stats.latency.counts):
+                    cumulative += count
+                    lines.append(
+                        f'db_query_duration_seconds_bucket{{{label},'
+                        f'le="{bound:.6g}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'db_query_duration_seconds_bucket{{{label},le="+Inf"}} '
+                    f'{stats.latency.count}'
+                )
+                lines.append(
+                    f"db_query_duration_seconds_sum{{{label}}} {stats.latency.sum}"
+                )
+                lines.append(
+                    f"db_query_duration_seconds_count{{{label}}} "
+                    f"{stats.latency.count}"
+                )
+                totals.append((label, stats.calls, stats.errors, stats.rows))
+        for name, index, help_text in (
+            ("db_query_calls_total", 1, "Calls by fingerprint."),
+            ("db_query_errors_total", 2, "Failed calls by fingerprint."),
+            ("db_query_rows_total", 3, "Rows returned by fingerprint."),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{{{total[0]}}} {total[index]}" for total in totals)
+        return "\n".join(lines) + "\n"
+
+
+# Registry fed by log_queries.
+registry = MetricsRegistry()
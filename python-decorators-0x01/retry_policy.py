@@ -0,0 +1,186 @@
+import asyncio
+import random
+import sqlite3
+import threading
+import time
+
+# OperationalError messages that mean "try again later", not "this is wrong".
+TRANSIENT_MESSAGES = (
+    "database is locked",
+    "database table is locked",
+    "database is busy",
+    "disk i/o error",
+    "unable to open database file",
+)
+
+
+def is_transient(error):
+    """Default classifier: SQLite lock/busy and I/O errors are retryable."""
+    if isinstance(error, sqlite3.OperationalError):
+        message = str(error).lower()
+        return any(text in message for text in TRANSIENT_MESSAGES)
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+def classifier(retry_on):
+    """Turn `retry_on` (None, exception classes or a predicate) into a predicate."""
+    if retry_on is None:
+        return is_transient
+    if isinstance(retry_on, (type, tuple)):
+        return lambda error: isinstance(error, retry_on)
+    return retry_on
+
+
+BACKOFFS = ("constant", "exponential", "decorrelated")
+
+
+def delays(backoff, delay, max_delay):
+    """Yield the sleep before each retry for a backoff strategy.
+
+    "constant" always waits `delay`; "exponential" uses full jitter over
+    delay * 2**n; "decorrelated" uses decorrelated jitter. All are
+    capped at `max_delay`.
+    """
+    if backoff == "constant":
+        while True:
+            yield delay
+    elif backoff == "exponential":
+        attempt = 0
+        while True:
+            yield random.uniform(0, min(max_delay, delay * 2 ** attempt))
+            attempt += 1
+    elif backoff == "decorrelated":
+        sleep = delay
+        while True:
+            sleep = min(max_delay, random.uniform(delay, sleep * 3))
+            yield sleep
+
+
+class RetryBudget:
+    """Process-wide cap on retries relative to successful calls.
+
+    Each success deposits `ratio` tokens, each retry spends one, and
+    `min_per_second` tokens trickle in regardless so a cold process can
+    still retry. When the budget is empty, failures are raised at once
+    instead of adding to a retry storm.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=100.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount):
+        now = time.monotonic()
+        amount += (now - self._updated) * self.min_per_second
+        self._updated = now
+        self._tokens = min(self.max_tokens, self._tokens + amount)
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """Spend a token for one retry; False if the budget is exhausted."""
+        with self._lock:
+            self._refill(0)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RetryStats:
+    """Counters for retried calls, shared by every retry_on_failure."""
+
+    FIELDS = ("calls", "attempts", "retries", "successes", "failures",
+              "non_retryable", "budget_exhausted", "sleep_seconds")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, field, amount=1):
+        with self._lock:
+            self._counts[field] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+budget = RetryBudget()
+stats = RetryStats()
+
+
+def _next_wait(error, attempt, retries, waits, retryable, retry_budget):
+    """Return the sleep before the next attempt, or None to give up."""
+    print(f"Attempt {attempt} failed: {error}")
+    if not retryable(error):
+        stats.add("non_retryable")
+        stats.add("failures")
+        return None
+    if attempt >= retries:
+        print("All retries failed.")
+        stats.add("failures")
+        return None
+    if retry_budget is not None and not retry_budget.withdraw():
+        print("Retry budget exhausted.")
+        stats.add("budget_exhausted")
+        stats.add("failures")
+        return None
+    wait = next(waits)
+    stats.add("retries")
+    stats.add("sleep_seconds", wait)
+    return wait
+
+
+def _succeeded(retry_budget):
+    stats.add("successes")
+    if retry_budget is not None:
+        retry_budget.deposit()
+
+
+def call(fn, retries=3, delay=2, backoff="exponential", max_delay=30,
+         retryable=is_transient, retry_budget=budget):
+    """Call fn(), retrying retryable failures with backoff.
+
+    Gives up after `retries` attempts, on the first error `retryable`
+    rejects, or when `retry_budget` has no tokens left.
+    """
+    stats.add("calls")
+    waits = delays(backoff, delay, max_delay)
+    for attempt in range(1, retries + 1):
+        stats.add("attempts")
+        try:
+            result = fn()
+        except Exception as e:
+            wait = _next_wait(e, attempt, retries, waits, retryable, retry_budget)
+            if wait is None:
+                raise
+            time.sleep(wait)
+        else:
+            _succeeded(retry_budget)
+            return result
+
+
+async def call_async(fn, retries=3, delay=2, backoff="exponential", max_delay=30,
+                     retryable=is_transient, retry_budget=budget):
+    """Like call(), for a coroutine function; waits with asyncio.sleep()."""
+    stats.add("calls")
+    waits = delays(backoff, delay, max_delay)
+    for attempt in range(1, retries + 1):
+        stats.add("attempts")
+        try:
+            result = await fn()
+        except Exception as e:
+            wait = _next_wait(e, attempt, retries, waits, retryable, retry_budget)
+            if wait is None:
+                raise
+            await asyncio.sleep(wait)
+        else:
+            _succeeded(retry_budget)
+            return result
@@ -0,0 +1,251 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key BLOB PRIMARY KEY,
+    value BLOB NOT NULL,
+    buffers BLOB,
+    expires REAL NOT NULL,
+    stale_until REAL NOT NULL,
+    tables TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS entry_tables (
+    tbl TEXT NOT NULL,
+    key BLOB NOT NULL,
+    PRIMARY KEY (tbl, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entry_tables_key ON entry_tables (key);
+CREATE TABLE IF NOT EXISTS generations (
+    tbl TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Applied to every connection; losing the cache file on a crash is fine.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+GET_QUERY = (
+    "SELECT value, buffers, expires, stale_until, tables FROM entries "
+    "WHERE key = ? AND stale_until > ?"
+)
+
+_LENGTH = struct.Struct("<I")
+
+
+def _digest(key):
+    return hashlib.blake2b(pickle.dumps(key, protocol=5), digest_size=16).digest()
+
+
+def dumps(value):
+    """Pickle `value` with protocol 5, keeping buffers out of band.
+
+    Objects that export PickleBuffers (numpy arrays, for one) have their
+    data stored raw next to the pickle instead of copied into it.
+
+    Returns (payload, buffers); `buffers` holds each out-of-band buffer
+    behind a 4-byte length, or is None when there are none.
+    """
+    buffers = []
+    payload = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+    if not buffers:
+        return payload, None
+    parts = []
+    for buffer in buffers:
+        raw = buffer.raw()
+        parts.append(_LENGTH.pack(raw.nbytes))
+        parts.append(raw)
+    return payload, b"".join(parts)
+
+
+def loads(payload, buffers=None):
+    """Inverse of dumps(); out-of-band buffers are not copied."""
+    views = []
+    if buffers is not None:
+        view = memoryview(buffers)
+        offset = 0
+        while offset < len(view):
+            (size,) = _LENGTH.unpack_from(view, offset)
+            offset += _LENGTH.size
+            views.append(view[offset:offset + size])
+            offset += size
+    return pickle.loads(payload, buffers=views)
+
+
+class SharedCacheStore:
+    """Second-level query cache in a SQLite file shared by processes.
+
+    Sits behind a QueryCache (see QueryCache(l2=...)): entries stored in
+    any worker process can be read by the others, so only one of them
+    has to run a query. Entries are keyed by a hash of the cache key,
+    expire by wall-clock time and are indexed by the tables they were
+    read from, so a write in any process drops them from the store.
+    Other processes' own QueryCache entries are not reached and live out
+    their TTL.
+
+    Every invalidation also bumps a generation counter kept in the file
+    for each table. set(since=generation()) checks it in the same
+    transaction as the write, so a result read before another process
+    wrote one of its tables is not stored.
+
+    The store is best-effort: values that cannot be pickled are not
+    stored, and entries that cannot be unpickled or SQLite errors (e.g.
+    a file locked for longer than `timeout`) count as misses. Expired
+    entries are purged every `purge_every` stores.
+    """
+
+    def __init__(self, path="query_cache.db", timeout=1.0, purge_every=256):
+        self.path = path
+        self.timeout = timeout
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._sets = 0
+        self._connection()  # Create the schema now
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection must not be used on both sides of a fork(), e.g.
+        # by gunicorn --preload workers: the child opens its own
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.executescript("".join(
+                f"PRAGMA {name} = {value};" for name, value in PRAGMAS.items()
+            ) + SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def generation(self):
+        """Return the latest invalidation generation, or None on error."""
+        try:
+            (value,) = self._connection().execute(
+                "SELECT COALESCE(MAX(generation), 0) FROM generations"
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        return value
+
+    def get(self, key):
+        """Return (value, expires, stale_until, tables) or None.
+
+        `expires` and `stale_until` are time.time() timestamps.
+        """
+        try:
+            row = self._connection().execute(
+                GET_QUERY, (_digest(key), time.time())
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        payload, buffers, expires, stale_until, tables = row
+        try:
+            value = loads(payload, buffers)
+        except Exception:  # e.g. a class renamed since it was stored
+            return None
+        tables = frozenset(tables.split(",")) if tables else frozenset()
+        return value, expires, stale_until, tables
+
+    def set(self, key, value, expires, stale_until, tables=(), since=None):
+        """Store `value`; return whether it was stored.
+
+        With `since` (a generation() read before the query ran), nothing
+        is stored if one of `tables` was invalidated after it.
+        """
+        try:
+            payload, buffers = dumps(value)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return False
+        digest = _digest(key)
+        tables = list(tables)
+        conn = self._connection()
+        try:
+            with conn:
+                # Take the write lock first so no invalidation can land
+                # between the check and the write
+                conn.execute("BEGIN IMMEDIATE")
+                if since is not None and tables:
+                    (latest,) = conn.execute(
+                        "SELECT COALESCE(MAX(generation), 0) FROM generations "
+                        f"WHERE tbl IN ({','.join('?' * len(tables))})",
+                        tables,
+                    ).fetchone()
+                    if latest > since:
+                        return False
+                conn.execute("DELETE FROM entry_tables WHERE key = ?", (digest,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                    (digest, payload, buffers, expires, stale_until,
+                     ",".join(sorted(tables))),
+                )
+                conn.executemany(
+                    "INSERT INTO entry_tables VALUES (?, ?)",
+                    [(table, digest) for table in tables],
+                )
+        except sqlite3.Error:
+            return False
+        self._sets += 1
+        if self._sets % self.purge_every == 0:
+            self.purge()
+        return True
+
+    def invalidate_tables(self, tables):
+        """Drop every entry read from one of `tables`; return how many.
+
+        Also bumps the generation of `tables`, so set() calls with an
+        older `since` are refused, in this process or any other.
+        """
+        tables = list(tables)
+        if not tables:
+            return 0
+        marks = ",".join("?" * len(tables))
+        conn = self._connection()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                (latest,) = conn.execute(
+                    "SELECT COALESCE(MAX(generation), 0) FROM generations"
+                ).fetchone()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO generations VALUES (?, ?)",
+                    [(table, latest + 1) for table in tables],
+                )
+                keys = conn.execute(
+                    f"SELECT DISTINCT key FROM entry_tables WHERE tbl IN ({marks})",
+                    tables,
+                ).fetchall()
+                conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+                conn.executemany("DELETE FROM entry_tables WHERE key = ?", keys)
+        except sqlite3.Error as e:
+            print(f"Shared cache invalidation failed: {e}")
+            return 0
+        return len(keys)
+
+    def purge(self):
+        """Delete entries that can no longer be served, even stale."""
+        now = time.time()
+        conn = self._connection()
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM entry_tables WHERE key IN "
+                    "(SELECT key FROM entries WHERE stale_until <= ?)", (now,)
+                )
+                conn.execute("DELETE FROM entries WHERE stale_until <= ?", (now,))
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM entry_tables")
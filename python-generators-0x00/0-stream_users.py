@@ -1,27 +1,46 @@
 #!/usr/bin/python3
-    
+
+from collections import namedtuple
 import mysql.connector
+import db_pool
+
+USER_COLUMNS = ("name", "email", "age")
+
+# Lightweight alternative to a dict per row.
+UserRow = namedtuple("UserRow", USER_COLUMNS)
+
+ROW_BUILDERS = {
+    "dict": lambda row: dict(zip(USER_COLUMNS, row)),
+    "tuple": tuple,
+    "row": UserRow._make,
+}
+
 
-def stream_users():
-    """Stream rows from user_data table one by one using a generator."""
-    connection = None
-    cursor = None
+def stream_users(chunk_size=None, row_type="dict"):
+    """Stream rows from user_data table one by one using a generator.
+
+    By default rows are read one at a time from the cursor. With
+    `chunk_size` the rows are pulled from an unbuffered cursor with
+    fetchmany(), so at most one chunk is held client-side and memory stays
+    flat regardless of table size. `row_type` selects what is yielded:
+    "dict", "tuple" or "row" (a UserRow namedtuple).
+    """
+    if row_type not in ROW_BUILDERS:
+        raise ValueError(f"Unknown row_type {row_type!r}")
+    build = ROW_BUILDERS[row_type]
     try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="ALX_prodev"
-        )
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT name, email, age FROM user_data")
-        for row in cursor:
-            yield row
+        # Leaving early leaves unread rows behind; the pool then discards
+        # the connection rather than reuse it.
+        with db_pool.lease() as connection:
+            cursor = connection.cursor(buffered=False)
+            cursor.execute("SELECT name, email, age FROM user_data")
+            if chunk_size is None:
+                yield from map(build, cursor)
+            else:
+                rows = cursor.fetchmany(chunk_size)
+                while rows:
+                    yield from map(build, rows)
+                    rows = cursor.fetchmany(chunk_size)
+            cursor.close()
     except mysql.connector.Error as e:
         print(f"Error streaming users: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
-
@@ -1,42 +1,151 @@
 #!/usr/bin/python3
 
+from array import array
+from itertools import compress
 import mysql.connector
+import db_pool
 
-def stream_users_in_batches(batch_size):
-    """Generator that yields batches of users from the database."""
-    connection = None
-    cursor = None
+try:
+    import numpy
+except ImportError:  # Columnar batches fall back to array.array and lists
+    numpy = None
+
+# Identifiers and operators a predicate may use; values are always bound.
+USER_COLUMNS = ("user_id", "name", "email", "age")
+OPERATORS = ("=", "!=", "<", "<=", ">", ">=", "LIKE", "IN")
+NUMERIC_COLUMNS = ("age",)
+
+
+def compile_query(columns=None, where=()):
+    """Compile a projection and predicates into a user_data query.
+
+    `where` holds (column, operator, value) tuples, which become the SQL
+    WHERE clause, and/or callables taking a row dict, which can't be
+    expressed in SQL and are returned as post-filters. Returns
+    (sql, params, post_filters).
+    """
+    columns = tuple(columns or ("name", "email", "age"))
+    unknown = [column for column in columns if column not in USER_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown user_data columns: {unknown}")
+    clauses = []
+    params = []
+    post_filters = []
+    for predicate in where:
+        if callable(predicate):
+            post_filters.append(predicate)
+            continue
+        column, operator, value = predicate
+        operator = operator.upper()
+        if column not in USER_COLUMNS or operator not in OPERATORS:
+            raise ValueError(f"Unsupported predicate: {predicate!r}")
+        if operator == "IN":
+            values = list(value)
+            if not values:  # IN () is a syntax error and matches nothing
+                clauses.append("FALSE")
+                continue
+            clauses.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+        else:
+            clauses.append(f"{column} {operator} %s")
+            params.append(value)
+    sql = f"SELECT {', '.join(columns)} FROM user_data"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    return sql, tuple(params), post_filters
+
+
+def to_columns(rows, columns):
+    """Transpose a list of row tuples into one array per column.
+
+    Numeric columns become float64 arrays (numpy if installed, otherwise
+    array.array("d")); text columns become object arrays or lists.
+    """
+    values = zip(*rows) if rows else ((),) * len(columns)
+    batch = {}
+    for column, column_values in zip(columns, values):
+        if column in NUMERIC_COLUMNS:
+            if numpy is not None:
+                batch[column] = numpy.array(column_values, dtype=numpy.float64)
+            else:
+                batch[column] = array("d", map(float, column_values))
+        elif numpy is not None:
+            batch[column] = numpy.array(column_values, dtype=object)
+        else:
+            batch[column] = list(column_values)
+    return batch
+
+
+def _mask_columns(batch, mask):
+    """Keep the entries of a columnar batch where `mask` is true."""
+    if numpy is not None:
+        mask = numpy.asarray(mask, dtype=bool)
+        return {column: values[mask] for column, values in batch.items()}
+    return {
+        column: array("d", compress(values, mask))
+        if isinstance(values, array) else list(compress(values, mask))
+        for column, values in batch.items()
+    }
+
+
+def _columnar_batches(cursor, columns, batch_size, post_filters):
+    """Yield columnar batches from `cursor`, applying vectorized filters."""
+    rows = cursor.fetchmany(batch_size)
+    while rows:
+        batch = to_columns(rows, columns)
+        for keep in post_filters:
+            batch = _mask_columns(batch, keep(batch))
+        if len(batch[columns[0]]):
+            yield batch
+        rows = cursor.fetchmany(batch_size)
+
+
+def stream_users_in_batches(batch_size, columns=None, where=(), columnar=False):
+    """Generator that yields batches of users from the database.
+
+    `columns` and `where` are compiled by compile_query(), so only the
+    selected columns of matching rows leave the server. Callable
+    predicates are applied to each row before it is batched.
+
+    With `columnar` each batch is a dict of column arrays (see
+    to_columns()) instead of a list of row dicts, and callable predicates
+    receive that dict and return a boolean mask, e.g.
+    ``lambda batch: batch["age"] > 25`` with numpy.
+    """
+    sql, params, post_filters = compile_query(columns, where)
     try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="ALX_prodev"
-        )
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT name, email, age FROM user_data")
-        
-        batch = []
-        for row in cursor:  # 1st loop
-            batch.append(row)
-            if len(batch) == batch_size:
+        with db_pool.lease() as connection:
+            cursor = connection.cursor(dictionary=not columnar)
+            cursor.execute(sql, params)
+
+            if columnar:
+                yield from _columnar_batches(
+                    cursor, cursor.column_names, batch_size, post_filters
+                )
+                cursor.close()
+                return
+
+            batch = []
+            for row in cursor:  # 1st loop
+                if post_filters and not all(keep(row) for keep in post_filters):
+                    continue
+                batch.append(row)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:  # Yield the last partial batch
                 yield batch
-                batch = []
-        if batch:  # Yield the last partial batch
-            yield batch
+            cursor.close()
 
     except mysql.connector.Error as e:
         print(f"Error streaming users in batches: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
 
 
-def batch_processing(batch_size):
-    """Processes batches and yields users over age 25."""
-    for batch in stream_users_in_batches(batch_size):  # 2nd loop
-        filtered_batch = [user for user in batch if user.get("age", 0) > 25]  # 3rd loop (list comprehension)
-        if filtered_batch:
-            yield filtered_batch
+def batch_processing(batch_size, where=(("age", ">", 25),), columns=None,
+                     columnar=False):
+    """Processes batches and yields users over age 25.
+
+    The age filter is pushed down to SQL; pass other `where` predicates
+    to select a different set of users.
+    """
+    yield from stream_users_in_batches(batch_size, columns, where, columnar)
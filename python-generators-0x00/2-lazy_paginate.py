@@ -1,21 +1,132 @@
 #!/usr/bin/python3
-import seed
+import base64
+import json
+import db_pool
 
-def paginate_users(page_size, offset):
+# Columns lazy_paginate can seek on: the primary key, and the columns
+# seed.create_table() indexes together with user_id. Identifiers can't be
+# bound as query parameters, so anything outside this list is rejected.
+KEYSET_COLUMNS = ("user_id", "name", "email", "age")
+
+OFFSET_QUERY = "SELECT * FROM user_data LIMIT %s OFFSET %s"
+
+
+def _fetch_page(cursor, query, params):
+    """Run a page query on `cursor` and return the rows as dicts."""
+    cursor.execute(query, params)
+    columns = cursor.column_names
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def paginate_users(page_size, offset, cursor=None):
     """Fetch a page of users from user_data."""
-    connection = seed.connect_to_prodev()
-    cursor = connection.cursor(dictionary=True)
-    cursor.execute(f"SELECT * FROM user_data LIMIT {page_size} OFFSET {offset}")
-    rows = cursor.fetchall()
-    connection.close()
+    if cursor is not None:
+        return _fetch_page(cursor, OFFSET_QUERY, (page_size, offset))
+    with db_pool.lease() as connection:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(OFFSET_QUERY, (page_size, offset))
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+
+def _keyset_query(key, after):
+    """Build the seek query for `key`, with user_id as the tie-breaker."""
+    if key not in KEYSET_COLUMNS:
+        raise ValueError(f"Cannot paginate on column {key!r}")
+    columns = ("user_id",) if key == "user_id" else (key, "user_id")
+    order_by = ", ".join(columns)
+    if after is None:
+        return f"SELECT * FROM user_data ORDER BY {order_by} LIMIT %s"
+    return (
+        f"SELECT * FROM user_data WHERE ({order_by}) > "
+        f"({', '.join(['%s'] * len(columns))}) ORDER BY {order_by} LIMIT %s"
+    )
+
+
+def paginate_users_after(page_size, key="user_id", after=None, cursor=None):
+    """Fetch the page of users that follows `after` in `key` order.
+
+    `after` holds the key values of the last row already seen, as
+    returned by decode_cursor(). Each page is an index seek on the
+    primary key or the (key, user_id) index from seed.create_table(), so
+    page N costs the same as page 1.
+    """
+    params = tuple(after or ()) + (page_size,)
+    if cursor is not None:
+        return _fetch_page(cursor, _keyset_query(key, after), params)
+    with db_pool.lease() as connection:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(_keyset_query(key, after), params)
+        rows = cursor.fetchall()
+        cursor.close()
     return rows
 
-def lazy_paginate(page_size):
-    """Lazily yield pages of user_data."""
-    offset = 0
-    while True:
-        page = paginate_users(page_size, offset)
-        if not page:  # No more data
-            break
-        yield page  # Yield page
-        offset += page_size
\ No newline at end of file
+
+def _last_seen(page, key):
+    """Key values of the last row in `page`."""
+    last = page[-1]
+    if key == "user_id":
+        return (last["user_id"],)
+    return (last[key], last["user_id"])
+
+
+def page_cursor(page, key="user_id"):
+    """Return an opaque token that resumes pagination after `page`."""
+    values = [str(value) for value in _last_seen(page, key)]
+    payload = json.dumps([key, values])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(token):
+    """Decode a page_cursor() token into (key, after)."""
+    try:
+        key, after = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid pagination cursor: {token!r}") from e
+    return key, tuple(after)
+
+
+def lazy_paginate(page_size, key=None, cursor=None, connection=None):
+    """Lazily yield pages of user_data.
+
+    Without `key` or `cursor` pages are fetched with LIMIT/OFFSET. Passing
+    one of KEYSET_COLUMNS as `key` switches to keyset pagination
+    (WHERE key > last_seen ORDER BY key), and `cursor` resumes from a
+    token produced by page_cursor().
+
+    All pages are read over one pooled connection through a single
+    prepared cursor, so the statement is prepared once rather than per
+    page. The connection goes back to the pool when the generator
+    finishes, is closed or is garbage collected. A `connection` passed in
+    by the caller is used as-is and left open.
+    """
+    after = None
+    if cursor is not None:
+        cursor_key, after = decode_cursor(cursor)
+        if key is not None and key != cursor_key:
+            raise ValueError(f"Cursor was issued for {cursor_key!r}, not {key!r}")
+        key = cursor_key
+    pool = db_pool.get_pool() if connection is None else None
+    if pool is not None:
+        connection = pool.acquire()
+    statement = None
+    try:
+        statement = connection.cursor(prepared=True)
+        offset = 0
+        while True:
+            if key is None:
+                page = paginate_users(page_size, offset, statement)
+            else:
+                page = paginate_users_after(page_size, key, after, statement)
+            if not page:  # No more data
+                break
+            yield page  # Yield page
+            offset += page_size
+            if key is not None:
+                after = _last_seen(page, key)
+    finally:
+        if statement:
+            statement.close()
+        if pool is not None:
+            pool.release(connection)
@@ -1,34 +1,188 @@
 #!/usr/bin/python3
 
+import math
 import mysql.connector
+import db_pool
+
+STATS_QUERY = """
+SELECT COUNT(age), AVG(age), MIN(age), MAX(age), STDDEV_POP(age)
+FROM user_data
+"""
+
+# Nearest-rank percentiles, all read in one pass over the ages in order
+# (the (age, user_id) index from seed.create_table() already has them
+# sorted). Window functions need MySQL 8; older servers fall back to
+# streaming.
+PERCENTILE_QUERY = """
+SELECT row_index, age FROM (
+    SELECT age, ROW_NUMBER() OVER (ORDER BY age) - 1 AS row_index
+    FROM user_data
+) ranked
+WHERE row_index IN ({marks})
+"""
+
 
 def stream_user_ages():
     """Stream user ages one by one using a generator."""
     try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="ALX_prodev"
-        )
-        cursor = connection.cursor()
-        cursor.execute("SELECT age FROM user_data")
-        for age in cursor:  # Single loop to yield ages
-            yield age[0]
-        cursor.close()
-        connection.close()
+        with db_pool.lease() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT age FROM user_data")
+            for age in cursor:  # Single loop to yield ages
+                yield age[0]
+            cursor.close()
     except mysql.connector.Error as e:
         print(f"Error streaming ages: {e}")
 
-def calculate_average_age():
-    """Calculate average age using streamed ages."""
-    total = 0
-    count = 0
-    for age in stream_user_ages():  # Single loop to process ages
-        total += float(age)
-        count += 1
-    average = total / count if count > 0 else 0
+
+class P2Quantile:
+    """Streaming estimate of one quantile in O(1) memory (the P² algorithm).
+
+    Keeps five markers whose heights track the minimum, p/2, p, (1+p)/2
+    and maximum of everything seen so far.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(1, 5) if x < q[i]) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:
+            return q[min(len(q) - 1, round(self.p * (len(q) - 1)))]
+        return q[2]
+
+
+class AgeStats:
+    """Single-pass accumulator for count, mean, stddev, min, max and quantiles.
+
+    Mean and variance use Welford's update, so nothing but the running
+    moments is kept.
+    """
+
+    def __init__(self, percentiles=()):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.quantiles = {p: P2Quantile(p) for p in percentiles}
+
+    def add(self, age):
+        age = float(age)
+        self.count += 1
+        delta = age - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (age - self.mean)
+        self.min = age if self.min is None else min(self.min, age)
+        self.max = age if self.max is None else max(self.max, age)
+        for quantile in self.quantiles.values():
+            quantile.add(age)
+
+    def result(self):
+        return {
+            "count": self.count,
+            "mean": self.mean if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "stddev": math.sqrt(self.m2 / self.count) if self.count else None,
+            "percentiles": {p: q.value() for p, q in self.quantiles.items()},
+        }
+
+
+def _as_float(value):
+    return None if value is None else float(value)
+
+
+def _pushdown_age_stats(percentiles):
+    """Compute the age summary in MySQL, returning one small result set."""
+    with db_pool.lease() as connection:
+        cursor = connection.cursor()
+        cursor.execute(STATS_QUERY)
+        count, mean, low, high, stddev = cursor.fetchone()
+        values = dict.fromkeys(percentiles)
+        if count and percentiles:
+            positions = {p: round(p * (count - 1)) for p in percentiles}
+            wanted = sorted(set(positions.values()))
+            marks = ", ".join(["%s"] * len(wanted))
+            cursor.execute(PERCENTILE_QUERY.format(marks=marks), wanted)
+            ages = {position: float(age) for position, age in cursor}
+            values = {p: ages[position] for p, position in positions.items()}
+        cursor.close()
+    return {
+        "count": count,
+        "mean": _as_float(mean),
+        "min": _as_float(low),
+        "max": _as_float(high),
+        "stddev": _as_float(stddev),
+        "percentiles": values,
+    }
+
+
+def user_age_stats(percentiles=(), pushdown=True):
+    """Summary statistics of user ages.
+
+    Returns count, mean, min, max, stddev and the requested `percentiles`
+    (fractions between 0 and 1). The work is pushed down to SQL unless
+    `pushdown` is False or the query fails, in which case ages are
+    streamed once through an AgeStats accumulator.
+    """
+    percentiles = tuple(percentiles)
+    for p in percentiles:
+        if not 0 <= p <= 1:
+            raise ValueError(f"Percentile {p!r} is not between 0 and 1")
+    if pushdown:
+        try:
+            return _pushdown_age_stats(percentiles)
+        except mysql.connector.Error as e:
+            print(f"Falling back to streaming age stats: {e}")
+    stats = AgeStats(percentiles)
+    for age in stream_user_ages():
+        stats.add(age)
+    return stats.result()
+
+
+def calculate_average_age(pushdown=True):
+    """Calculate average age of users."""
+    average = user_age_stats(pushdown=pushdown)["mean"] or 0
     print(f"Average age of users: {average:.2f}")
 
 if __name__ == "__main__":
-    calculate_average_age()
\ No newline at end of file
+    calculate_average_age()
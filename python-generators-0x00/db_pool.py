@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+import os
+import threading
+import time
+from contextlib import contextmanager
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+# Connection settings, overridable from the environment.
+DB_CONFIG = {
+    "host": os.environ.get("MYSQL_HOST", "localhost"),
+    "user": os.environ.get("MYSQL_USER", "root"),
+    "password": os.environ.get("MYSQL_PASSWORD", ""),
+}
+DATABASE = os.environ.get("MYSQL_DATABASE", "ALX_prodev")
+
+
+class ConnectionPool:
+    """Bounded pool of MySQL connections shared by the generators.
+
+    Keeps at least `min_size` connections open and never more than
+    `max_size`. Idle connections above `min_size` are closed after
+    `idle_timeout` seconds, and a connection that sat idle for longer than
+    `health_check_after` seconds is pinged before it is handed out.
+    Callers wait up to `timeout` seconds for a free connection before a
+    PoolError is raised.
+    """
+
+    def __init__(self, min_size=1, max_size=10, idle_timeout=300,
+                 health_check_after=30, timeout=30, **config):
+        if not 0 <= min_size <= max_size:
+            raise ValueError("Need 0 <= min_size <= max_size")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self.config = config
+        self._idle = []  # (connection, idle since) pairs, newest last
+        self._size = 0
+        self._lease_started = {}
+        self._closed = False
+        self._available = threading.Condition()
+        self._stats = {
+            "created": 0,
+            "closed": 0,
+            "failed_health_checks": 0,
+            "leases": 0,
+            "timeouts": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "lease_seconds": 0.0,
+        }
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _count(self, name):
+        with self._available:
+            self._stats[name] += 1
+
+    def _connect(self):
+        connection = mysql.connector.connect(**self.config)
+        self._count("created")
+        return connection
+
+    def _close(self, connection):
+        self._count("closed")
+        try:
+            connection.close()
+        except mysql.connector.Error:
+            pass
+
+    def _expired(self, now):
+        """Pop idle connections past idle_timeout. Caller holds the lock."""
+        expired = []
+        while self._size > self.min_size and self._idle:
+            connection, since = self._idle[0]
+            if now - since < self.idle_timeout:
+                break
+            self._idle.pop(0)
+            self._size -= 1
+            expired.append(connection)
+        return expired
+
+    def acquire(self):
+        """Check out a connection, opening one if the pool has room."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            connection = None
+            idle_since = None
+            with self._available:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolError("Timed out waiting for a connection")
+                    self._available.wait(remaining)
+                expired = self._expired(time.monotonic())
+                if self._idle:
+                    connection, idle_since = self._idle.pop()
+                else:
+                    self._size += 1
+            for stale in expired:
+                self._close(stale)
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except mysql.connector.Error:
+                    self._discarded()
+                    raise
+            elif time.monotonic() - idle_since > self.health_check_after \
+                    and not connection.is_connected():
+                self._count("failed_health_checks")
+                self._close(connection)
+                self._discarded()
+                continue
+            now = time.monotonic()
+            waited = now - started
+            with self._available:
+                self._stats["leases"] += 1
+                self._stats["wait_seconds"] += waited
+                self._stats["max_wait_seconds"] = max(
+                    self._stats["max_wait_seconds"], waited
+                )
+                self._lease_started[id(connection)] = now
+            return connection
+
+    def _discarded(self):
+        with self._available:
+            self._size -= 1
+            self._available.notify()
+
+    def release(self, connection, discard=False):
+        """Return a connection to the pool, or close it if `discard`.
+
+        Connections with unread results can't be reused and are always
+        discarded; open transactions are rolled back.
+        """
+        with self._available:
+            started = self._lease_started.pop(id(connection), None)
+            if started is not None:
+                self._stats["lease_seconds"] += time.monotonic() - started
+        if not discard and not self._closed:
+            try:
+                discard = connection.unread_result
+                if not discard and connection.in_transaction:
+                    connection.rollback()
+            except mysql.connector.Error:
+                discard = True
+        if discard or self._closed:
+            self._close(connection)
+            self._discarded()
+            return
+        with self._available:
+            self._idle.append((connection, time.monotonic()))
+            self._available.notify()
+
+    @contextmanager
+    def lease(self):
+        """Context manager that checks a connection out and back in."""
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def stats(self):
+        """Snapshot of pool size and lease counters."""
+        with self._available:
+            stats = dict(self._stats)
+            stats.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+            )
+        return stats
+
+    def close(self):
+        """Close every idle connection. Leased ones close on release."""
+        with self._available:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._closed = True
+        for connection, _ in idle:
+            self._close(connection)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool for the ALX_prodev database."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                min_size=int(os.environ.get("MYSQL_POOL_MIN", 1)),
+                max_size=int(os.environ.get("MYSQL_POOL_MAX", 10)),
+                database=DATABASE,
+                **DB_CONFIG
+            )
+        return _pool
+
+
+def lease():
+    """Lease a connection from the shared pool."""
+    return get_pool().lease()
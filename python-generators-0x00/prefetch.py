@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+import queue
+import threading
+
+_DONE = object()
+
+
+def prefetch(iterable, depth=1):
+    """Iterate `iterable` on a background thread, up to `depth` items ahead.
+
+    Wrap stream_users_in_batches() or lazy_paginate() with it so the next
+    batch is fetched from MySQL while the caller works on the current one.
+    An exception raised by the source is re-raised to the caller, and
+    closing the wrapper (or letting it be garbage collected) stops the
+    thread and closes the source generator, releasing its connection.
+    """
+    if depth < 1:
+        raise ValueError("depth must be at least 1")
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(entry):
+        """Queue `entry`, giving up if the consumer has gone away."""
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        source = iter(iterable)
+        outcome = (_DONE, None)
+        try:
+            for item in source:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            outcome = (_DONE, e)
+        finally:
+            # The source is only ever touched from this thread, so it has
+            # to be closed here too.
+            close = getattr(source, "close", None)
+            if close:
+                close()
+        put(outcome)
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
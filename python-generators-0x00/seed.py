@@ -1,17 +1,20 @@
 import csv
+import io
+import os
+import time
 import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, errorcode
+import db_pool
 
 
 def connect_db():
     """Connects to MySQL server (no DB selected)."""
     try:
-        connection = mysql.connector.connect(
-            host='localhost',
-            user='root',
-            password=''  
-        )
+        connection = mysql.connector.connect(**db_pool.DB_CONFIG)
         return connection
     except Error as e:
         print(f"Error connecting to MySQL: {e}")
@@ -29,14 +32,13 @@ def create_database(connection):
         print(f"Error creating database: {e}")
 
 
-def connect_to_prodev():
+def connect_to_prodev(allow_local_infile=False):
     """Connects to ALX_prodev database."""
     try:
         connection = mysql.connector.connect(
-            host='localhost',
-            user='root',
-            password='',  
-            database='ALX_prodev'
+            database=db_pool.DATABASE,
+            allow_local_infile=allow_local_infile,
+            **db_pool.DB_CONFIG
         )
         return connection
     except Error as e:
@@ -44,8 +46,17 @@ def connect_to_prodev():
         return None
 
 
+# Secondary indexes for keyset pagination on each column, with user_id
+# as the tie-breaker (see 2-lazy_paginate.py).
+KEYSET_INDEXES = {
+    "name_user_id": ("name", "user_id"),
+    "email_user_id": ("email", "user_id"),
+    "age_user_id": ("age", "user_id"),
+}
+
+
 def create_table(connection):
-    """Creates user_data table."""
+    """Creates user_data table, adding any missing keyset indexes."""
     try:
         cursor = connection.cursor()
         create_query = """
@@ -58,6 +69,13 @@ def create_table(connection):
         );
         """
         cursor.execute(create_query)
+        for index, columns in KEYSET_INDEXES.items():
+            try:
+                cursor.execute(f"ALTER TABLE user_data ADD INDEX {index} "
+                               f"({', '.join(columns)})")
+            except Error as e:
+                if e.errno != errorcode.ER_DUP_KEYNAME:  # Already there
+                    raise
         connection.commit()
         cursor.close()
         print("Table user_data created successfully")
@@ -72,9 +90,9 @@ def insert_data(connection, csv_file):
         with open(csv_file, mode='r') as file:
             reader = csv.DictReader(file)
             for row in reader:
-                user_id = str(uuid.uuid4())
                 name = row['name']
                 email = row['email']
+                user_id = user_id_for(email)
                 age = row['age']
                 insert_query = """
                 INSERT IGNORE INTO user_data (user_id, name, email, age)
@@ -88,3 +106,211 @@ def insert_data(connection, csv_file):
         print(f"Error inserting data: {e}")
     except FileNotFoundError:
         print(f"File {csv_file} not found.")
+
+
+# Namespace for deterministic user_ids, so re-seeding the same CSV maps
+# every email to the same key and INSERT IGNORE skips it.
+USER_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_DNS, 'user_data.alx_prodev')
+
+
+def user_id_for(email):
+    """Returns the deterministic user_id for an email address."""
+    return str(uuid.uuid5(USER_ID_NAMESPACE, email))
+
+
+INSERT_QUERY = """
+INSERT IGNORE INTO user_data (user_id, name, email, age)
+VALUES (%s, %s, %s, %s)
+"""
+
+# user_id_for(@email) in SQL: SHA-1 of namespace + name, with the
+# version nibble set to 5 and the variant bits to 10 (RFC 4122).
+_USER_ID_HASH = f"SHA1(CONCAT(UNHEX('{USER_ID_NAMESPACE.hex}'), @email))"
+USER_ID_SQL = (
+    "CONCAT("
+    f"SUBSTR({_USER_ID_HASH}, 1, 8), '-', "
+    f"SUBSTR({_USER_ID_HASH}, 9, 4), '-5', "
+    f"SUBSTR({_USER_ID_HASH}, 14, 3), '-', "
+    f"LOWER(HEX(8 | (CONV(SUBSTR({_USER_ID_HASH}, 17, 1), 16, 10) & 3))), "
+    f"SUBSTR({_USER_ID_HASH}, 18, 3), '-', "
+    f"SUBSTR({_USER_ID_HASH}, 21, 12))"
+)
+
+LOAD_DATA_QUERY = """
+LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE user_data
+CHARACTER SET utf8mb4
+FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+IGNORE 1 LINES
+({columns})
+SET email = @email, user_id = {user_id}
+"""
+
+
+def _report(rows, started):
+    """Prints how many rows were inserted and at what rate."""
+    elapsed = time.perf_counter() - started
+    rate = rows / elapsed if elapsed else float('inf')
+    print(f"Inserted {rows} rows in {elapsed:.2f}s ({rate:.0f} rows/s)")
+
+
+def _load_data_infile(connection, csv_file):
+    """Loads csv_file server-side with LOAD DATA LOCAL INFILE."""
+    with open(csv_file, mode='r', newline='') as file:
+        header = next(csv.reader(file))
+    # email goes through @email so user_id can be derived from it;
+    # columns the table doesn't know are read into a throwaway variable.
+    columns = ", ".join(
+        '@email' if name == 'email'
+        else name if name in ('name', 'age') else '@skip'
+        for name in header
+    )
+    cursor = connection.cursor()
+    cursor.execute(
+        LOAD_DATA_QUERY.format(columns=columns, user_id=USER_ID_SQL),
+        (csv_file,),
+    )
+    rows = cursor.rowcount
+    connection.commit()
+    cursor.close()
+    return rows
+
+
+def _insert_rows(connection, rows, batch_size, commit_size):
+    """Inserts (user_id, name, email, age) tuples in executemany batches.
+
+    Returns how many rows were inserted; rows INSERT IGNORE skipped as
+    duplicates are not counted.
+    """
+    cursor = connection.cursor()
+    inserted = 0
+    uncommitted = 0
+    batch = list(islice(rows, batch_size))
+    while batch:
+        # executemany() rewrites this into a single multi-row INSERT.
+        cursor.executemany(INSERT_QUERY, batch)
+        inserted += max(cursor.rowcount, 0)
+        uncommitted += len(batch)
+        if uncommitted >= commit_size:
+            connection.commit()
+            uncommitted = 0
+        batch = list(islice(rows, batch_size))
+    connection.commit()
+    cursor.close()
+    return inserted
+
+
+def bulk_insert_data(connection, csv_file, batch_size=1000,
+                     commit_size=50000, local_infile=False):
+    """Bulk-loads user_data.csv into the user_data table.
+
+    Rows are sent as multi-row INSERTs of `batch_size` rows through
+    executemany() and committed every `commit_size` rows. With
+    `local_infile` the whole file is handed to LOAD DATA LOCAL INFILE
+    instead, which needs a connection from
+    connect_to_prodev(allow_local_infile=True). Either way user_ids are
+    user_id_for(email), so loading the same file again inserts nothing.
+    """
+    started = time.perf_counter()
+    try:
+        if local_infile:
+            rows = _load_data_infile(connection, csv_file)
+        else:
+            with open(csv_file, mode='r', newline='') as file:
+                reader = csv.reader(file)
+                header = next(reader)
+                name, email, age = (header.index(column)
+                                    for column in ('name', 'email', 'age'))
+                rows = _insert_rows(
+                    connection,
+                    ((user_id_for(row[email]), row[name], row[email], row[age])
+                     for row in reader),
+                    batch_size,
+                    commit_size,
+                )
+        _report(rows, started)
+        return rows
+    except Error as e:
+        print(f"Error bulk inserting data: {e}")
+    except FileNotFoundError:
+        print(f"File {csv_file} not found.")
+
+
+def _csv_chunks(csv_file, chunks):
+    """Splits csv_file into byte ranges that start and end on line breaks.
+
+    Returns the header line and a list of (start, end) offsets covering
+    the data rows. Assumes no quoted field contains a newline.
+    """
+    size = os.path.getsize(csv_file)
+    with open(csv_file, mode='rb') as file:
+        header = file.readline()
+        start = file.tell()
+        step = max((size - start) // chunks, 1)
+        ranges = []
+        while start < size:
+            file.seek(min(start + step, size))
+            file.readline()  # Move to the end of the current line
+            end = min(file.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return header.decode(), ranges
+
+
+def _parse_chunk(args):
+    """Parses one byte range of the CSV into user_data tuples."""
+    csv_file, header, start, end = args
+    with open(csv_file, mode='rb') as file:
+        file.seek(start)
+        data = file.read(end - start).decode()
+    columns = next(csv.reader([header]))
+    name, email, age = (columns.index(column)
+                        for column in ('name', 'email', 'age'))
+    return [(user_id_for(row[email]), row[name], row[email], row[age])
+            for row in csv.reader(io.StringIO(data, newline=''))]
+
+
+def _insert_chunk(rows, batch_size, commit_size):
+    """Inserts parsed rows over a pooled connection."""
+    with db_pool.lease() as connection:
+        return _insert_rows(connection, iter(rows), batch_size, commit_size)
+
+
+def parallel_insert_data(csv_file, workers=None, connections=4,
+                         batch_size=1000, commit_size=50000):
+    """Seeds user_data from csv_file with parallel parsers and writers.
+
+    The file is split into byte-range chunks that a process pool parses,
+    while up to `connections` threads insert the parsed chunks, each over
+    a connection leased from db_pool. user_ids are UUIDv5 of the email, so
+    re-running the seed is idempotent under INSERT IGNORE.
+
+    A chunk is only sent to be parsed when an earlier one has been handed
+    to a writer, and at most 2 * `connections` parsed chunks wait to be
+    inserted, so memory stays bounded when the writers fall behind.
+    """
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    try:
+        header, ranges = _csv_chunks(csv_file, workers * 4)
+        tasks = ((csv_file, header, start, end) for start, end in ranges)
+        rows = 0
+        with ProcessPoolExecutor(max_workers=workers) as parsers, \
+                ThreadPoolExecutor(max_workers=connections) as writers:
+            parses = deque(parsers.submit(_parse_chunk, task)
+                           for task in islice(tasks, workers))
+            inserts = deque()
+            while parses:
+                chunk = parses.popleft().result()
+                for task in islice(tasks, 1):
+                    parses.append(parsers.submit(_parse_chunk, task))
+                inserts.append(writers.submit(
+                    _insert_chunk, chunk, batch_size, commit_size))
+                while len(inserts) >= 2 * connections:
+                    rows += inserts.popleft().result()
+            rows += sum(insert.result() for insert in inserts)
+        _report(rows, started)
+        return rows
+    except Error as e:
+        print(f"Error inserting data in parallel: {e}")
+    except FileNotFoundError:
+        print(f"File {csv_file} not found.")